@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from config import AI_USER_RATE_PER_MIN, AI_USER_BURST, AI_MAX_CONCURRENCY, AI_MAX_QUEUE, WORKERS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_SUMMARY = 0
+PRIORITY_CHAT = 10
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float = None) -> bool:
+        self._refill(now or time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class UserRateLimiter:
+    def __init__(self, per_minute: float, burst: int, max_tracked: int = 10_000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_tracked = max_tracked
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def allow(self, user_id: int) -> tuple[bool, float]:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_tracked:
+                self._prune()
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        if bucket.try_take():
+            return True, 0.0
+        return False, bucket.retry_after()
+
+    def _prune(self):
+        # Full buckets carry no information, dropping them is equivalent to a fresh start.
+        now = time.monotonic()
+        for uid in [uid for uid, b in self._buckets.items() if b.is_full(now)]:
+            del self._buckets[uid]
+
+
+class PriorityGate:
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    def position(self, fut: asyncio.Future) -> int:
+        entry = next((e for e in self._waiters if e[2] is fut), None)
+        if entry is None:
+            return 0
+        return 1 + sum(1 for e in self._waiters if e[:2] < entry[:2] and not e[2].done())
+
+    async def acquire(self, priority: int, on_queued=None):
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+            return
+        # Summaries and broadcasts are never rejected, only chat traffic is bounded.
+        if priority >= PRIORITY_CHAT and self.queued >= self.max_queue:
+            raise QueueFull()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(self.position(fut))
+                except Exception as e:
+                    # Only a progress note (e.g. "message is not modified"); keep the place in line.
+                    logger.warning("Queue notification failed: %s", e)
+            await fut
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                fut.cancel()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int, on_queued=None):
+        await self.acquire(priority, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# The limits are totals: with WORKERS processes each one gets its share (at least
+# one slot), so OpenRouter never sees more than about AI_MAX_CONCURRENCY calls.
+_shares = max(1, WORKERS)
+ai_gate = PriorityGate(max(1, AI_MAX_CONCURRENCY // _shares), max(1, AI_MAX_QUEUE // _shares))
+ai_user_limiter = UserRateLimiter(AI_USER_RATE_PER_MIN, AI_USER_BURST)
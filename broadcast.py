@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+import db
+from tg_html import render_chunks, strip_tags
+
+logger = logging.getLogger(__name__)
+
+RECIPIENT_BATCH = 500
+MAX_SEND_ATTEMPTS = 3
+PERMANENT_BAD_REQUESTS = ("chat not found", "user not found", "peer_id_invalid", "group chat was deactivated")
+
+
+class PermanentDeliveryError(Exception):
+    pass
+
+
+def _is_permanent(exc: Exception) -> bool:
+    if isinstance(exc, Forbidden):
+        return True
+    return isinstance(exc, BadRequest) and any(m in exc.message.lower() for m in PERMANENT_BAD_REQUESTS)
+
+
+async def _send_part(bot, chat_id: int, part: str):
+    # A chat that stays flood-limited after MAX_SEND_ATTEMPTS tries counts as failed;
+    # the last RetryAfter propagates to broadcast_summary.
+    for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+        try:
+            await bot.send_message(
+                chat_id=chat_id, text=part, parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+            )
+            return
+        except RetryAfter as e:
+            if attempt == MAX_SEND_ATTEMPTS:
+                raise
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            if _is_permanent(e):
+                raise PermanentDeliveryError(str(e)) from e
+            await bot.send_message(chat_id=chat_id, text=strip_tags(part), disable_web_page_preview=True)
+            return
+
+
+async def broadcast_summary(bot, summary: str, kind: str = "summary") -> dict:
+    parts = render_chunks(summary)
+    run_id = await db.start_broadcast_run(kind)
+    sent = 0
+    failed = 0
+    pruned = 0
+    async for batch in db.iter_broadcast_recipients(RECIPIENT_BATCH):
+        blocked = []
+        for chat_id in batch:
+            try:
+                for part in parts:
+                    await _send_part(bot, chat_id, part)
+                sent += 1
+            except PermanentDeliveryError as e:
+                logger.info("Pruning recipient %s: %s", chat_id, e)
+                blocked.append(chat_id)
+            except Exception as e:
+                logger.error("Failed to send to %s: %s", chat_id, e)
+                failed += 1
+        if blocked:
+            await db.mark_users_blocked(blocked)
+            pruned += len(blocked)
+    await db.finish_broadcast_run(run_id, sent, failed, pruned)
+    logger.info("Broadcast %s: sent=%d failed=%d pruned=%d", kind, sent, failed, pruned)
+    return {"sent": sent, "failed": failed, "pruned": pruned}
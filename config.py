@@ -9,3 +9,23 @@ DB_PATH = os.getenv("DB_PATH", "data/bot.db")
 AI_MODEL = os.getenv("AI_MODEL", "google/gemma-3n-e4b-it")
 MORNING_HOUR_UTC = 5
 EVENING_HOUR_UTC = 20
+AI_USER_RATE_PER_MIN = float(os.getenv("AI_USER_RATE_PER_MIN", "6"))
+AI_USER_BURST = int(os.getenv("AI_USER_BURST", "3"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "20"))
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "900"))
+SUMMARY_LEAD_MINUTES = int(os.getenv("SUMMARY_LEAD_MINUTES", "15"))
+SUMMARY_INPUTS_WAIT_SECONDS = int(os.getenv("SUMMARY_INPUTS_WAIT_SECONDS", "30"))
+ANALYTICS_RETENTION_DAYS = max(7, int(os.getenv("ANALYTICS_RETENTION_DAYS", "90")))
+MAINTENANCE_HOUR_UTC = int(os.getenv("MAINTENANCE_HOUR_UTC", "2"))
+QUOTE_MAX_AGE_SECONDS = int(os.getenv("QUOTE_MAX_AGE_SECONDS", "300"))
+WORKERS = int(os.getenv("WORKERS", "0"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "30"))
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "")
+NEWS_SEARCH_TIMEOUT = float(os.getenv("NEWS_SEARCH_TIMEOUT", "8"))
+NEWS_FALLBACK_HOURS = int(os.getenv("NEWS_FALLBACK_HOURS", "48"))
+NEWS_RETENTION_DAYS = int(os.getenv("NEWS_RETENTION_DAYS", "30"))
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "8"))
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", "1500"))
+CHAT_MEMORY_IDLE_SECONDS = int(os.getenv("CHAT_MEMORY_IDLE_SECONDS", "1800"))
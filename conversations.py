@@ -0,0 +1,115 @@
+import re
+import time
+from collections import OrderedDict, deque
+
+from config import CHAT_MEMORY_TURNS, CHAT_MEMORY_TOKENS, CHAT_MEMORY_IDLE_SECONDS
+
+MAX_CONVERSATIONS = 5000
+TURN_MAX_CHARS = 1200
+DIGEST_MAX_CHARS = 1200
+DIGEST_ITEM_CHARS = 160
+SWEEP_INTERVAL = 300
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def estimate_tokens(text: str) -> int:
+    # Close enough for budgeting mixed Russian/English text without a tokenizer.
+    return len(text) // 3 + 1
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+def _gist(role: str, text: str) -> str:
+    # Extractive: the first sentence of a turn is usually the question or the answer.
+    first = _SENTENCE_RE.split(_TAG_RE.sub("", text).strip(), 1)[0]
+    return f"{'Пользователь' if role == 'user' else 'Ассистент'}: {_clip(first, DIGEST_ITEM_CHARS)}"
+
+
+class _Conversation:
+    __slots__ = ("turns", "tokens", "digest", "last_seen")
+
+    def __init__(self):
+        self.turns: deque[tuple[str, str, int]] = deque()
+        self.tokens = 0
+        self.digest = ""
+        self.last_seen = time.monotonic()
+
+
+class ConversationMemory:
+    # Recent turns are kept verbatim in a ring buffer bounded by turn count and
+    # token budget. Turns pushed out are folded into a short extractive digest, which
+    # is itself capped, so a conversation never costs more than about
+    # token_budget + DIGEST_MAX_CHARS / 3 tokens. Idle conversations are dropped.
+
+    def __init__(
+        self,
+        max_turns: int = CHAT_MEMORY_TURNS,
+        token_budget: int = CHAT_MEMORY_TOKENS,
+        idle_seconds: int = CHAT_MEMORY_IDLE_SECONDS,
+    ):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.idle_seconds = idle_seconds
+        self._conversations: OrderedDict[int, _Conversation] = OrderedDict()
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def _sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        # Ordered by last use, so idle conversations are at the front.
+        while self._conversations:
+            user_id, conv = next(iter(self._conversations.items()))
+            if now - conv.last_seen < self.idle_seconds:
+                break
+            del self._conversations[user_id]
+
+    def _get(self, user_id: int, now: float) -> _Conversation | None:
+        conv = self._conversations.get(user_id)
+        if conv is not None and now - conv.last_seen >= self.idle_seconds:
+            del self._conversations[user_id]
+            return None
+        return conv
+
+    def messages(self, user_id: int) -> list[dict]:
+        now = time.monotonic()
+        self._sweep(now)
+        conv = self._get(user_id, now)
+        if conv is None:
+            return []
+        result = []
+        if conv.digest:
+            result.append({"role": "system", "content": f"Ранее в диалоге:\n{conv.digest}"})
+        result.extend({"role": role, "content": text} for role, text, _ in conv.turns)
+        return result
+
+    def record(self, user_id: int, question: str, answer: str):
+        now = time.monotonic()
+        conv = self._get(user_id, now)
+        if conv is None:
+            conv = self._conversations[user_id] = _Conversation()
+        self._conversations.move_to_end(user_id)
+        conv.last_seen = now
+        for role, text in (("user", question), ("assistant", answer)):
+            text = _clip(text, TURN_MAX_CHARS)
+            tokens = estimate_tokens(text)
+            conv.turns.append((role, text, tokens))
+            conv.tokens += tokens
+        while len(conv.turns) > self.max_turns or (conv.tokens > self.token_budget and len(conv.turns) > 2):
+            role, text, tokens = conv.turns.popleft()
+            conv.tokens -= tokens
+            conv.digest = f"{conv.digest}\n{_gist(role, text)}".strip()
+        if len(conv.digest) > DIGEST_MAX_CHARS:
+            # Oldest digest lines go first.
+            conv.digest = conv.digest[-DIGEST_MAX_CHARS:].split("\n", 1)[-1]
+        while len(self._conversations) > MAX_CONVERSATIONS:
+            self._conversations.popitem(last=False)
+
+    def clear(self, user_id: int):
+        self._conversations.pop(user_id, None)
+
+
+conversations = ConversationMemory()
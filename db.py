@@ -1,8 +1,15 @@
 import aiosqlite
+import logging
 import os
+import sqlite3
+import time
 from datetime import datetime, timedelta
 from config import DB_PATH, ADMIN_IDS
 
+logger = logging.getLogger(__name__)
+
+VACUUM_AT_BOOT_MAX_BYTES = 8 * 1024 * 1024
+
 
 async def get_conn():
     os.makedirs(os.path.dirname(DB_PATH) if os.path.dirname(DB_PATH) else ".", exist_ok=True)
@@ -12,55 +19,382 @@ async def get_conn():
     return conn
 
 
+async def _applied_schema_version(conn) -> int:
+    try:
+        cur = await conn.execute("SELECT MAX(version) FROM schema_migrations")
+        return (await cur.fetchone())[0] or 0
+    except sqlite3.OperationalError:
+        # Databases created before schema_migrations tracked their version in user_version.
+        cur = await conn.execute("PRAGMA user_version")
+        return (await cur.fetchone())[0]
+
+
 async def init_db():
+    if not os.path.exists(DB_PATH):
+        # auto_vacuum only applies without a full VACUUM when set before the file has
+        # any content, so a new database gets it before get_conn switches to WAL.
+        os.makedirs(os.path.dirname(DB_PATH) if os.path.dirname(DB_PATH) else ".", exist_ok=True)
+        fresh = await aiosqlite.connect(DB_PATH)
+        try:
+            await fresh.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await fresh.execute("PRAGMA journal_mode=WAL")
+        finally:
+            await fresh.close()
     conn = await get_conn()
     try:
-        await conn.executescript("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                is_authenticated INTEGER DEFAULT 0,
-                is_admin INTEGER DEFAULT 0,
-                created_at TEXT DEFAULT (datetime('now')),
-                last_active TEXT DEFAULT (datetime('now'))
-            );
-            CREATE TABLE IF NOT EXISTS coins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT UNIQUE NOT NULL,
+        applied = await _applied_schema_version(conn)
+        if applied >= SCHEMA_VERSION:
+            return
+        await conn.execute(
+            """CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
                 name TEXT NOT NULL,
-                cmc_slug TEXT,
-                active INTEGER DEFAULT 1,
-                added_at TEXT DEFAULT (datetime('now'))
-            );
-            CREATE TABLE IF NOT EXISTS analytics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER NOT NULL,
-                action TEXT NOT NULL,
-                details TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
-            );
-            CREATE INDEX IF NOT EXISTS idx_analytics_created ON analytics(created_at);
-            CREATE INDEX IF NOT EXISTS idx_users_telegram ON users(telegram_id);
-        """)
+                applied_at TEXT DEFAULT (datetime('now'))
+            )"""
+        )
+        for version, name, _ in MIGRATIONS[:applied]:
+            await conn.execute(
+                "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, NULL)",
+                (version, name),
+            )
+        await conn.commit()
+        for version, name, migrate in MIGRATIONS[applied:]:
+            await migrate(conn)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name)
+            )
+            await conn.commit()
+            logger.info("Applied migration %d: %s", version, name)
+    finally:
+        await conn.close()
+
+
+async def _migrate_base_schema(conn):
+    await conn.executescript("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            is_authenticated INTEGER DEFAULT 0,
+            is_admin INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now')),
+            last_active TEXT DEFAULT (datetime('now'))
+        );
+        CREATE TABLE IF NOT EXISTS coins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            cmc_slug TEXT,
+            active INTEGER DEFAULT 1,
+            added_at TEXT DEFAULT (datetime('now'))
+        );
+        CREATE TABLE IF NOT EXISTS analytics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            details TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        CREATE TABLE IF NOT EXISTS user_states (
+            telegram_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_user_states_expires ON user_states(expires_at);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_analytics_created ON analytics(created_at);
+        CREATE INDEX IF NOT EXISTS idx_users_telegram ON users(telegram_id);
+    """)
+    await conn.execute(
+        "UPDATE coins SET symbol = 'RNBW' WHERE symbol = 'RAINBOW' AND cmc_slug = 'rainbow'"
+    )
+    for sym, name, slug in [("OWB", "OWB", "owb"), ("RNBW", "Rainbow", "rainbow")]:
+        cur = await conn.execute("SELECT id FROM coins WHERE symbol = ?", (sym,))
+        row = await cur.fetchone()
+        if not row:
+            await conn.execute(
+                "INSERT INTO coins (symbol, name, cmc_slug) VALUES (?, ?, ?)",
+                (sym, name, slug),
+            )
+        else:
+            await conn.execute(
+                "UPDATE coins SET cmc_slug = ? WHERE symbol = ? AND (cmc_slug IS NULL OR cmc_slug = '')",
+                (slug, sym),
+            )
+
+
+async def _add_column(conn, table: str, column: str, definition: str):
+    # DDL is not rolled back with the schema_migrations insert, so a migration that
+    # died after its ALTER must be able to run again.
+    cur = await conn.execute(f"PRAGMA table_info({table})")
+    if column not in {row["name"] for row in await cur.fetchall()}:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _migrate_coins_cmc_id(conn):
+    await _add_column(conn, "coins", "cmc_id", "INTEGER")
+
+
+async def _migrate_user_browser_indexes(conn):
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id)")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)"
+    )
+
+
+async def _migrate_broadcast_runs(conn):
+    await _add_column(conn, "users", "is_blocked", "INTEGER DEFAULT 0")
+    await conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_users_recipients ON users(id)
+            WHERE is_authenticated = 1 AND is_blocked = 0;
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            started_at TEXT DEFAULT (datetime('now')),
+            finished_at TEXT,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            pruned INTEGER DEFAULT 0
+        );
+    """)
+
+
+async def _migrate_analytics_daily(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS analytics_daily (
+            day TEXT NOT NULL,
+            action TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, action)
+        ) WITHOUT ROWID"""
+    )
+    await conn.commit()
+    # Converting an existing file needs a full VACUUM; only small databases pay for
+    # it at boot, larger ones are converted by the maintenance job.
+    if await _database_bytes(conn) <= VACUUM_AT_BOOT_MAX_BYTES:
+        await _enable_incremental_vacuum(conn)
+
+
+async def _database_bytes(conn) -> int:
+    page_count = (await (await conn.execute("PRAGMA page_count")).fetchone())[0]
+    page_size = (await (await conn.execute("PRAGMA page_size")).fetchone())[0]
+    return page_count * page_size
+
+
+async def _enable_incremental_vacuum(conn) -> bool:
+    cur = await conn.execute("PRAGMA auto_vacuum")
+    if (await cur.fetchone())[0] == 2:
+        return False
+    await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await conn.execute("VACUUM")
+    return True
+
+
+async def _migrate_workload_indexes(conn):
+    # Matches the filters in get_analytics and the broadcast/user-list queries; see
+    # tools/check_query_plans.py. idx_users_telegram duplicated the UNIQUE autoindex.
+    await conn.executescript("""
+        DROP INDEX IF EXISTS idx_users_telegram;
+        DROP INDEX IF EXISTS idx_analytics_created;
+        CREATE INDEX IF NOT EXISTS idx_analytics_created_action ON analytics(created_at, action);
+        CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active);
+        CREATE INDEX IF NOT EXISTS idx_users_authenticated ON users(is_authenticated)
+            WHERE is_authenticated = 1;
+        CREATE INDEX IF NOT EXISTS idx_users_blocked ON users(is_blocked) WHERE is_blocked = 1;
+        CREATE INDEX IF NOT EXISTS idx_coins_active ON coins(active) WHERE active = 1;
+    """)
+
+
+async def _migrate_cmc_map(conn):
+    await conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cmc_map (
+            cmc_id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            slug TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rank INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_cmc_map_symbol ON cmc_map(symbol, rank);
+        CREATE INDEX IF NOT EXISTS idx_cmc_map_slug ON cmc_map(slug);
+    """)
+
+
+async def _migrate_latest_quotes(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS latest_quotes (
+            symbol TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        ) WITHOUT ROWID"""
+    )
+
+
+async def _migrate_leases(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID"""
+    )
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS slot_claims (
+            slot TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            claimed_at REAL NOT NULL
+        ) WITHOUT ROWID"""
+    )
+
+
+async def _migrate_news_archive(conn):
+    await conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS news_items (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            symbol TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            title TEXT NOT NULL,
+            snippet TEXT NOT NULL DEFAULT '',
+            fetched_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_news_symbol_kind ON news_items(symbol, kind, fetched_at);
+        CREATE INDEX IF NOT EXISTS idx_news_fetched ON news_items(fetched_at);
+        CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+            title, snippet, content='news_items', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS news_items_ai AFTER INSERT ON news_items BEGIN
+            INSERT INTO news_fts (rowid, title, snippet) VALUES (new.id, new.title, new.snippet);
+        END;
+        CREATE TRIGGER IF NOT EXISTS news_items_ad AFTER DELETE ON news_items BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, snippet) VALUES ('delete', old.id, old.title, old.snippet);
+        END;
+        CREATE TRIGGER IF NOT EXISTS news_items_au AFTER UPDATE OF title, snippet ON news_items BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, snippet) VALUES ('delete', old.id, old.title, old.snippet);
+            INSERT INTO news_fts (rowid, title, snippet) VALUES (new.id, new.title, new.snippet);
+        END;
+        """
+    )
+
+
+async def _migrate_price_history(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS price_history (
+            symbol TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            price REAL NOT NULL,
+            volume REAL,
+            PRIMARY KEY (symbol, hour)
+        ) WITHOUT ROWID"""
+    )
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_price_history_hour ON price_history(hour)")
+
+
+async def _migrate_summary_snapshots(conn):
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS summary_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fingerprint TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )"""
+    )
+
+
+MIGRATIONS = [
+    (1, "base_schema", _migrate_base_schema),
+    (2, "coins_cmc_id", _migrate_coins_cmc_id),
+    (3, "user_browser_indexes", _migrate_user_browser_indexes),
+    (4, "broadcast_runs", _migrate_broadcast_runs),
+    (5, "analytics_daily", _migrate_analytics_daily),
+    (6, "workload_indexes", _migrate_workload_indexes),
+    (7, "cmc_map", _migrate_cmc_map),
+    (8, "latest_quotes", _migrate_latest_quotes),
+    (9, "leases", _migrate_leases),
+    (10, "news_archive", _migrate_news_archive),
+    (11, "price_history", _migrate_price_history),
+    (12, "summary_snapshots", _migrate_summary_snapshots),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_meta(key: str, default: str = None) -> str | None:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        row = await cur.fetchone()
+        return row["value"] if row else default
+    finally:
+        await conn.close()
+
+
+async def set_meta(key: str, value: str):
+    conn = await get_conn()
+    try:
         await conn.execute(
-            "UPDATE coins SET symbol = 'RNBW' WHERE symbol = 'RAINBOW' AND cmc_slug = 'rainbow'"
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def raise_meta_int(key: str, value: int):
+    # Never moves a value backwards, so concurrent writers cannot undo each other.
+    conn = await get_conn()
+    try:
+        await conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (key, value),
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    # Takes the lease if it is free or expired, renews it if we already hold it.
+    now = time.time()
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, holder, now + ttl, now),
+        )
+        await conn.commit()
+        return cur.rowcount > 0
+    finally:
+        await conn.close()
+
+
+async def release_lease(name: str, holder: str):
+    conn = await get_conn()
+    try:
+        await conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def claim_slot(slot: str, holder: str) -> bool:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "INSERT OR IGNORE INTO slot_claims (slot, holder, claimed_at) VALUES (?, ?, ?)",
+            (slot, holder, time.time()),
         )
-        for sym, name, slug in [("OWB", "OWB", "owb"), ("RNBW", "Rainbow", "rainbow")]:
-            cur = await conn.execute("SELECT id FROM coins WHERE symbol = ?", (sym,))
-            row = await cur.fetchone()
-            if not row:
-                await conn.execute(
-                    "INSERT INTO coins (symbol, name, cmc_slug) VALUES (?, ?, ?)",
-                    (sym, name, slug),
-                )
-            else:
-                await conn.execute(
-                    "UPDATE coins SET cmc_slug = ? WHERE symbol = ? AND (cmc_slug IS NULL OR cmc_slug = '')",
-                    (slug, sym),
-                )
         await conn.commit()
+        return cur.rowcount > 0
     finally:
         await conn.close()
 
@@ -81,7 +415,7 @@ async def get_or_create_user(telegram_id: int, username: str = None, first_name:
             user = await cur.fetchone()
         else:
             await conn.execute(
-                "UPDATE users SET last_active = datetime('now'), username = ?, first_name = ? WHERE telegram_id = ?",
+                "UPDATE users SET last_active = datetime('now'), username = ?, first_name = ?, is_blocked = 0 WHERE telegram_id = ?",
                 (username or user["username"], first_name or user["first_name"], telegram_id),
             )
             if telegram_id in ADMIN_IDS and not user["is_admin"]:
@@ -156,12 +490,56 @@ async def remove_coin(symbol: str):
         await conn.close()
 
 
-async def get_authenticated_users():
+async def iter_broadcast_recipients(batch_size: int = 500):
+    # Each batch uses its own short-lived connection, so no read transaction is held
+    # open while messages are being sent.
+    last_id = 0
+    while True:
+        conn = await get_conn()
+        try:
+            cur = await conn.execute(
+                "SELECT id, telegram_id FROM users WHERE is_authenticated = 1 AND is_blocked = 0 AND id > ? "
+                "ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            )
+            rows = await cur.fetchall()
+        finally:
+            await conn.close()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield [r["telegram_id"] for r in rows]
+
+
+async def mark_users_blocked(telegram_ids: list[int]):
     conn = await get_conn()
     try:
-        cur = await conn.execute("SELECT * FROM users WHERE is_authenticated = 1")
-        rows = await cur.fetchall()
-        return [dict(r) for r in rows]
+        await conn.executemany(
+            "UPDATE users SET is_blocked = 1 WHERE telegram_id = ?", [(t,) for t in telegram_ids]
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def start_broadcast_run(kind: str) -> int:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute("INSERT INTO broadcast_runs (kind) VALUES (?)", (kind,))
+        await conn.commit()
+        return cur.lastrowid
+    finally:
+        await conn.close()
+
+
+async def finish_broadcast_run(run_id: int, sent: int, failed: int, pruned: int):
+    conn = await get_conn()
+    try:
+        await conn.execute(
+            "UPDATE broadcast_runs SET finished_at = datetime('now'), sent = ?, failed = ?, pruned = ? WHERE id = ?",
+            (sent, failed, pruned, run_id),
+        )
+        await conn.commit()
     finally:
         await conn.close()
 
@@ -188,6 +566,17 @@ async def get_analytics():
             ).fetchone()
         )["c"]
 
+        blocked = (
+            await (
+                await conn.execute("SELECT COUNT(*) as c FROM users WHERE is_blocked = 1")
+            ).fetchone()
+        )["c"]
+        last_broadcast = await (
+            await conn.execute(
+                "SELECT kind, started_at, sent, failed, pruned FROM broadcast_runs ORDER BY id DESC LIMIT 1"
+            )
+        ).fetchone()
+
         day_ago = (datetime.utcnow() - timedelta(days=1)).isoformat()
         week_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
         month_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
@@ -232,6 +621,8 @@ async def get_analytics():
         return {
             "total_users": total,
             "authenticated_users": authed,
+            "blocked_users": blocked,
+            "last_broadcast": dict(last_broadcast) if last_broadcast else None,
             "active_24h": active_day,
             "active_7d": active_week,
             "active_30d": active_month,
@@ -242,13 +633,412 @@ async def get_analytics():
         await conn.close()
 
 
-async def get_all_users_list():
+USER_LIST_COLUMNS = "id, telegram_id, username, first_name, is_authenticated, is_admin, created_at, last_active"
+
+
+async def get_users_page(after_id: int = None, before_id: int = None, limit: int = 25):
+    # Newest first, keyset-paginated on (created_at, id). after_id is the last row
+    # shown (older page), before_id the first row shown (newer page).
+    conn = await get_conn()
+    try:
+        if before_id is not None:
+            cur = await conn.execute(
+                f"SELECT {USER_LIST_COLUMNS} FROM users "
+                "WHERE (created_at, id) > (SELECT created_at, id FROM users WHERE id = ?) "
+                "ORDER BY created_at ASC, id ASC LIMIT ?",
+                (before_id, limit + 1),
+            )
+            rows = [dict(r) for r in await cur.fetchall()]
+            has_newer = len(rows) > limit
+            return rows[:limit][::-1], True, has_newer
+        if after_id is not None:
+            cur = await conn.execute(
+                f"SELECT {USER_LIST_COLUMNS} FROM users "
+                "WHERE (created_at, id) < (SELECT created_at, id FROM users WHERE id = ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (after_id, limit + 1),
+            )
+        else:
+            cur = await conn.execute(
+                f"SELECT {USER_LIST_COLUMNS} FROM users ORDER BY created_at DESC, id DESC LIMIT ?",
+                (limit + 1,),
+            )
+        rows = [dict(r) for r in await cur.fetchall()]
+        return rows[:limit], len(rows) > limit, after_id is not None
+    finally:
+        await conn.close()
+
+
+async def search_users(query: str, limit: int = 25):
+    query = query.strip().lstrip("@")
+    conn = await get_conn()
+    try:
+        if query.isdigit():
+            cur = await conn.execute(
+                f"SELECT {USER_LIST_COLUMNS} FROM users WHERE telegram_id = ?", (int(query),)
+            )
+        else:
+            cur = await conn.execute(
+                f"SELECT {USER_LIST_COLUMNS} FROM users "
+                "WHERE username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ? "
+                "ORDER BY username COLLATE NOCASE LIMIT ?",
+                (query, query + "\uffff", limit),
+            )
+        return [dict(r) for r in await cur.fetchall()]
+    finally:
+        await conn.close()
+
+
+async def get_user_state(telegram_id: int, now: float):
     conn = await get_conn()
     try:
         cur = await conn.execute(
-            "SELECT telegram_id, username, first_name, is_authenticated, is_admin, created_at, last_active FROM users ORDER BY created_at DESC"
+            "SELECT state, expires_at FROM user_states WHERE telegram_id = ? AND expires_at > ?",
+            (telegram_id, now),
         )
-        rows = await cur.fetchall()
-        return [dict(r) for r in rows]
+        row = await cur.fetchone()
+        return (row["state"], row["expires_at"]) if row else None
+    finally:
+        await conn.close()
+
+
+async def set_user_state(telegram_id: int, state: str, expires_at: float):
+    conn = await get_conn()
+    try:
+        await conn.execute(
+            "INSERT INTO user_states (telegram_id, state, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(telegram_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+            (telegram_id, state, expires_at),
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def delete_user_state(telegram_id: int):
+    conn = await get_conn()
+    try:
+        await conn.execute("DELETE FROM user_states WHERE telegram_id = ?", (telegram_id,))
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def purge_expired_user_states(now: float) -> int:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute("DELETE FROM user_states WHERE expires_at <= ?", (now,))
+        await conn.commit()
+        return cur.rowcount
+    finally:
+        await conn.close()
+
+
+async def set_coin_cmc_ids(ids: dict[str, int | None]):
+    conn = await get_conn()
+    try:
+        await conn.executemany(
+            "UPDATE coins SET cmc_id = ? WHERE symbol = ?",
+            [(cmc_id, symbol) for symbol, cmc_id in ids.items()],
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def compact_analytics(retention_days: int, batch_size: int = 1000) -> int:
+    # One bounded batch per call and per transaction, so the write lock is held briefly.
+    conn = await get_conn()
+    try:
+        cutoff = f"-{int(retention_days)} days"
+        batch = (
+            "SELECT id FROM analytics WHERE created_at < datetime('now', ?) "
+            "ORDER BY created_at LIMIT ?"
+        )
+        await conn.execute(
+            "INSERT INTO analytics_daily (day, action, count) "
+            f"SELECT date(created_at), action, COUNT(*) FROM analytics WHERE id IN ({batch}) "
+            "GROUP BY date(created_at), action "
+            "ON CONFLICT(day, action) DO UPDATE SET count = count + excluded.count",
+            (cutoff, batch_size),
+        )
+        cur = await conn.execute(f"DELETE FROM analytics WHERE id IN ({batch})", (cutoff, batch_size))
+        await conn.commit()
+        return cur.rowcount
+    finally:
+        await conn.close()
+
+
+async def enable_incremental_vacuum() -> bool:
+    # Full VACUUM with an exclusive lock for the whole rewrite: only for
+    # tools/enable_incremental_vacuum.py, run by hand in a quiet moment.
+    conn = await get_conn()
+    try:
+        return await _enable_incremental_vacuum(conn)
+    finally:
+        await conn.close()
+
+
+async def incremental_vacuum(max_pages: int = 2000) -> int:
+    conn = await get_conn()
+    try:
+        if (await (await conn.execute("PRAGMA auto_vacuum")).fetchone())[0] != 2:
+            return 0
+        freelist = (await (await conn.execute("PRAGMA freelist_count")).fetchone())[0]
+        # executescript steps the pragma to completion; a plain execute frees a single page.
+        await conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        return min(freelist, max_pages)
+    finally:
+        await conn.close()
+
+
+EXPORT_COLUMNS = {
+    "users": ("telegram_id", "username", "first_name", "is_authenticated", "is_admin", "is_blocked", "created_at", "last_active"),
+    "analytics": ("id", "telegram_id", "action", "details", "created_at"),
+}
+
+
+async def iter_export_rows(table: str, batch_size: int = 1000):
+    columns = EXPORT_COLUMNS[table]
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+    finally:
+        await conn.close()
+
+
+async def replace_cmc_map(entries: list[tuple]):
+    conn = await get_conn()
+    try:
+        await conn.execute("DELETE FROM cmc_map")
+        await conn.executemany(
+            "INSERT OR REPLACE INTO cmc_map (cmc_id, symbol, slug, name, rank) VALUES (?, ?, ?, ?, ?)",
+            entries,
+        )
+        await conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('cmc_map_refreshed_at', datetime('now')) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def resolve_cmc_tokens(tokens: list[str]) -> dict[str, dict | None]:
+    # A token is tried as a slug first (unique), then as a symbol (best-ranked match).
+    conn = await get_conn()
+    try:
+        resolved = {}
+        for token in tokens:
+            cur = await conn.execute(
+                "SELECT cmc_id, symbol, slug, name FROM cmc_map WHERE slug = ?", (token.lower(),)
+            )
+            row = await cur.fetchone()
+            if row is None:
+                cur = await conn.execute(
+                    "SELECT cmc_id, symbol, slug, name FROM cmc_map WHERE symbol = ? "
+                    "ORDER BY rank IS NULL, rank LIMIT 1",
+                    (token.upper(),),
+                )
+                row = await cur.fetchone()
+            resolved[token] = dict(row) if row else None
+        return resolved
+    finally:
+        await conn.close()
+
+
+async def add_coins_bulk(coins: list[dict]) -> dict[int, str]:
+    # A coin already tracked under another local symbol (RNBW for CMC's RAINBOW) is
+    # matched by cmc_id or slug and reactivated instead of inserted twice. Returns
+    # {cmc_id: local symbol} for those.
+    conn = await get_conn()
+    try:
+        existing = {}
+        new = []
+        for c in coins:
+            cur = await conn.execute(
+                "SELECT symbol FROM coins WHERE cmc_id = ? OR cmc_slug = ? LIMIT 1", (c["cmc_id"], c["slug"])
+            )
+            row = await cur.fetchone()
+            if row and row["symbol"] != c["symbol"].upper():
+                existing[c["cmc_id"]] = row["symbol"]
+                await conn.execute(
+                    "UPDATE coins SET cmc_id = ?, cmc_slug = ?, active = 1 WHERE symbol = ?",
+                    (c["cmc_id"], c["slug"], row["symbol"]),
+                )
+            else:
+                new.append(c)
+        await conn.executemany(
+            "INSERT INTO coins (symbol, name, cmc_slug, cmc_id, active) VALUES (?, ?, ?, ?, 1) "
+            "ON CONFLICT(symbol) DO UPDATE SET name = excluded.name, cmc_slug = excluded.cmc_slug, "
+            "cmc_id = excluded.cmc_id, active = 1",
+            [(c["symbol"].upper(), c["name"], c["slug"], c["cmc_id"]) for c in new],
+        )
+        await conn.commit()
+        return existing
+    finally:
+        await conn.close()
+
+
+async def save_latest_quotes(rows: list[tuple[str, str, float]]):
+    conn = await get_conn()
+    try:
+        await conn.executemany(
+            "INSERT INTO latest_quotes (symbol, data, fetched_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(symbol) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at",
+            rows,
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def load_latest_quotes() -> list[tuple[str, str, float]]:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute("SELECT symbol, data, fetched_at FROM latest_quotes")
+        return [tuple(r) for r in await cur.fetchall()]
+    finally:
+        await conn.close()
+
+
+async def archive_news(symbol: str, kind: str, items: list[dict]):
+    # A URL is stored once; seeing it again only refreshes fetched_at.
+    if not items:
+        return
+    now = time.time()
+    conn = await get_conn()
+    try:
+        await conn.executemany(
+            "INSERT INTO news_items (url, symbol, kind, title, snippet, fetched_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET fetched_at = excluded.fetched_at",
+            [(i["url"], symbol, kind, i["title"], i.get("snippet", ""), now) for i in items if i.get("url")],
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def recent_news(symbol: str, kind: str, since: float, limit: int) -> list[dict]:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "SELECT title, url, snippet FROM news_items "
+            "WHERE symbol = ? AND kind = ? AND fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?",
+            (symbol, kind, since, limit),
+        )
+        return [dict(r) for r in await cur.fetchall()]
+    finally:
+        await conn.close()
+
+
+def _fts_query(text: str) -> str:
+    # Every word becomes a quoted prefix term, so user input cannot inject FTS syntax.
+    words = [w for w in text.replace('"', " ").split() if w]
+    return " ".join(f'"{w}"*' for w in words)
+
+
+async def search_news(query: str, symbol: str = None, since: float = 0, limit: int = 10) -> list[dict]:
+    conn = await get_conn()
+    try:
+        sql = (
+            "SELECT n.title, n.url, n.snippet, n.symbol, n.fetched_at FROM news_items n "
+            "WHERE n.fetched_at >= ?"
+        )
+        params = [since]
+        if symbol:
+            sql += " AND n.symbol = ?"
+            params.append(symbol)
+        match = _fts_query(query)
+        if match:
+            sql += " AND n.id IN (SELECT rowid FROM news_fts WHERE news_fts MATCH ? ORDER BY rank LIMIT 200)"
+            params.append(match)
+        sql += " ORDER BY n.fetched_at DESC LIMIT ?"
+        params.append(limit)
+        cur = await conn.execute(sql, params)
+        return [dict(r) for r in await cur.fetchall()]
+    finally:
+        await conn.close()
+
+
+async def prune_news(retention_days: int) -> int:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "DELETE FROM news_items WHERE fetched_at < ?", (time.time() - retention_days * 86400,)
+        )
+        await conn.commit()
+        return cur.rowcount
+    finally:
+        await conn.close()
+
+
+async def save_price_points(rows: list[tuple[str, int, float, float | None]]):
+    # One point per coin and hour; a later quote in the same hour replaces it.
+    conn = await get_conn()
+    try:
+        await conn.executemany(
+            "INSERT INTO price_history (symbol, hour, price, volume) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(symbol, hour) DO UPDATE SET price = excluded.price, volume = excluded.volume",
+            rows,
+        )
+        await conn.commit()
+    finally:
+        await conn.close()
+
+
+async def load_price_history(since_hour: int) -> list[tuple[str, int, float, float | None]]:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "SELECT symbol, hour, price, volume FROM price_history WHERE hour >= ? ORDER BY hour",
+            (since_hour,),
+        )
+        return [tuple(r) for r in await cur.fetchall()]
+    finally:
+        await conn.close()
+
+
+async def prune_price_history(before_hour: int) -> int:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute("DELETE FROM price_history WHERE hour < ?", (before_hour,))
+        await conn.commit()
+        return cur.rowcount
+    finally:
+        await conn.close()
+
+
+SUMMARY_SNAPSHOTS_KEPT = 50
+
+
+async def latest_summary_snapshot() -> dict | None:
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "SELECT fingerprint, digest, text, created_at FROM summary_snapshots ORDER BY id DESC LIMIT 1"
+        )
+        row = await cur.fetchone()
+        return dict(row) if row else None
+    finally:
+        await conn.close()
+
+
+async def save_summary_snapshot(fingerprint: str, digest: str, text: str):
+    conn = await get_conn()
+    try:
+        cur = await conn.execute(
+            "INSERT INTO summary_snapshots (fingerprint, digest, text, created_at) VALUES (?, ?, ?, ?)",
+            (fingerprint, digest, text, time.time()),
+        )
+        await conn.execute(
+            "DELETE FROM summary_snapshots WHERE id <= ?", (cur.lastrowid - SUMMARY_SNAPSHOTS_KEPT,)
+        )
+        await conn.commit()
     finally:
         await conn.close()
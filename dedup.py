@@ -0,0 +1,113 @@
+import logging
+import time
+from collections import OrderedDict
+
+import db
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = "update_watermark"
+WATERMARK_AT_KEY = "update_watermark_at"
+MAX_TRACKED = 5000
+GAP_TOLERANCE = 500
+# Telegram restarts update ids at a random value after a week without updates.
+SEQUENCE_RESET_SECONDS = 6 * 24 * 3600
+
+
+class UpdateDeduplicator:
+    # Telegram update ids grow one by one while updates keep coming. After a week
+    # with no updates the next id is picked at random and may be lower than anything
+    # seen before. The watermark is the id up to which everything counts as handled:
+    # it follows the contiguous run of seen ids and trails the newest id by at most
+    # GAP_TOLERANCE so a skipped id cannot stall it. Ids above it are remembered in
+    # an LRU. The watermark is persisted with the time it was last advanced, and is
+    # dropped when an id arrives below it after a long silence or as the first
+    # update after a restart, far below it.
+
+    def __init__(
+        self,
+        max_tracked: int = MAX_TRACKED,
+        gap_tolerance: int = GAP_TOLERANCE,
+        reset_after: float = SEQUENCE_RESET_SECONDS,
+    ):
+        self.max_tracked = max_tracked
+        self.gap_tolerance = gap_tolerance
+        self.reset_after = reset_after
+        self.watermark = None
+        self.newest = 0
+        self.last_seen_at = 0.0
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self._loaded = False
+        self._persisted = 0
+        self._rewind = False
+        self.dropped = 0
+
+    async def load(self):
+        stored = int(await db.get_meta(WATERMARK_KEY, "0") or 0)
+        stored_at = float(await db.get_meta(WATERMARK_AT_KEY, "0") or 0)
+        if not stored or time.time() - stored_at > self.reset_after:
+            return
+        self.watermark = max(self.watermark or 0, stored)
+        self.last_seen_at = max(self.last_seen_at, stored_at)
+        self._persisted = stored
+        self._loaded = True
+
+    def _reset(self, update_id: int):
+        logger.warning("Update ids restarted at %s below watermark %s, resetting", update_id, self.watermark)
+        self.watermark = update_id - 1
+        self.newest = 0
+        self._seen.clear()
+        self._rewind = True
+
+    def is_new(self, update_id: int, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        if self.watermark is None:
+            self.watermark = update_id - 1
+        elif update_id <= self.watermark and (
+            now - self.last_seen_at > self.reset_after
+            or (self._loaded and update_id < self.watermark - self.gap_tolerance)
+        ):
+            self._reset(update_id)
+        self._loaded = False
+        if update_id <= self.watermark or update_id in self._seen:
+            self.dropped += 1
+            return False
+        self._seen[update_id] = None
+        if len(self._seen) > self.max_tracked:
+            self._seen.popitem(last=False)
+        self.last_seen_at = now
+        self.newest = max(self.newest, update_id)
+        while self.watermark + 1 in self._seen:
+            self.watermark += 1
+        self.watermark = max(self.watermark, self.newest - self.gap_tolerance)
+        return True
+
+    async def flush(self):
+        if self.watermark is None or (self.watermark <= self._persisted and not self._rewind):
+            return
+        watermark, seen_at = self.watermark, self.last_seen_at
+        if self._rewind:
+            await db.set_meta(WATERMARK_KEY, str(watermark))
+            self._rewind = False
+        else:
+            await db.raise_meta_int(WATERMARK_KEY, watermark)
+        await db.set_meta(WATERMARK_AT_KEY, repr(seen_at))
+        self._persisted = watermark
+
+
+update_dedup = UpdateDeduplicator()
+
+
+async def dedup_guard(update, context):
+    from telegram.ext import ApplicationHandlerStop
+
+    if not update_dedup.is_new(update.update_id):
+        logger.info("Dropping duplicate update %s", update.update_id)
+        raise ApplicationHandlerStop
+
+
+async def flush_job(context):
+    try:
+        await update_dedup.flush()
+    except Exception as e:
+        logger.warning("Failed to persist update watermark: %s", e)
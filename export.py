@@ -0,0 +1,96 @@
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from telegram import InputFile
+
+import db
+import jsoncodec
+
+logger = logging.getLogger(__name__)
+
+
+class ExportTooLarge(Exception):
+    pass
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_BATCH = 1000
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+
+def _encode_batch(fmt: str, columns: tuple, rows: list[tuple], header: bool) -> bytes:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+        return buf.getvalue().encode("utf-8")
+    return "".join(
+        jsoncodec.dumps(dict(zip(columns, row, strict=True))) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+async def export_table(table: str, fmt: str) -> tuple[str, int]:
+    # Rows are pulled from the cursor one batch at a time and compressed off the
+    # event loop, so memory stays flat and updates keep flowing during big exports.
+    # Stops as soon as the file outgrows what Telegram would accept.
+    columns = db.EXPORT_COLUMNS[table]
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    count = 0
+    try:
+        gz = await asyncio.to_thread(gzip.open, path, "wb")
+        try:
+            if fmt == "csv":
+                await asyncio.to_thread(gz.write, _encode_batch(fmt, columns, [], header=True))
+            async for rows in db.iter_export_rows(table, EXPORT_BATCH):
+                await asyncio.to_thread(gz.write, _encode_batch(fmt, columns, rows, header=False))
+                count += len(rows)
+                if os.path.getsize(path) > MAX_DOCUMENT_BYTES:
+                    raise ExportTooLarge(f"more than {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB after {count} rows")
+        finally:
+            await asyncio.to_thread(gz.close)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, count
+
+
+async def send_export(bot, chat_id: int, table: str, fmt: str):
+    # Meant to run as a background task: reports failures to the admin itself.
+    try:
+        path, count = await export_table(table, fmt)
+    except ExportTooLarge as e:
+        logger.warning("Export of %s too large: %s", table, e)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"Экспорт {table} слишком большой для Telegram (больше {MAX_DOCUMENT_BYTES // (1024 * 1024)} МБ).",
+        )
+        return
+    except Exception as e:
+        logger.error("Export failed: %s", e)
+        await bot.send_message(chat_id=chat_id, text=f"Ошибка экспорта: {e}")
+        return
+    try:
+        size = os.path.getsize(path)
+        filename = f"{table}-{datetime.utcnow().strftime('%Y%m%d-%H%M')}.{fmt}.gz"
+        with open(path, "rb") as f:
+            # read_file_handle=False hands the open file to httpx, which streams it
+            # instead of PTB reading the whole archive into memory first.
+            await bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(f, filename=filename, read_file_handle=False),
+                caption=f"{table}: {count} строк",
+            )
+        logger.info("Exported %d %s rows as %s (%d bytes)", count, table, fmt, size)
+    except Exception as e:
+        logger.error("Export upload failed: %s", e)
+        await bot.send_message(chat_id=chat_id, text=f"Ошибка экспорта: {e}")
+    finally:
+        os.unlink(path)
@@ -0,0 +1,94 @@
+import logging
+import re
+import time
+
+import db
+import services
+from indicators import indicator_engine
+
+logger = logging.getLogger(__name__)
+
+MATCHER_TTL = 60
+HEADLINES_PER_COIN = 3
+HEADLINE_HOURS = 48
+
+
+class SymbolMatcher:
+    # One compiled regex over all tracked coins, rebuilt at most once a minute.
+    # Tickers match in upper case or with a $ prefix ("OWB", "$owb"), so short
+    # tickers do not fire on ordinary words; full names match in any case.
+
+    def __init__(self, ttl: int = MATCHER_TTL):
+        self.ttl = ttl
+        self.coins: dict[str, dict] = {}
+        self._names: dict[str, str] = {}
+        self._pattern: re.Pattern | None = None
+        self._built_at = 0.0
+
+    async def _refresh(self):
+        if self._built_at and time.monotonic() - self._built_at < self.ttl:
+            return
+        coins = await db.get_active_coins()
+        self.coins = {c["symbol"]: c for c in coins}
+        self._names = {c["name"].lower(): c["symbol"] for c in coins if c.get("name")}
+        alternatives = [rf"\$?{re.escape(sym)}" for sym in self.coins]
+        alternatives += [rf"(?i:\${re.escape(sym)})" for sym in self.coins]
+        alternatives += [rf"(?i:{re.escape(name)})" for name in self._names]
+        self._pattern = re.compile(
+            rf"(?<!\w)({'|'.join(sorted(alternatives, key=len, reverse=True))})(?!\w)"
+        ) if alternatives else None
+        self._built_at = time.monotonic()
+
+    async def match(self, text: str) -> list[str]:
+        await self._refresh()
+        if self._pattern is None:
+            return []
+        found = []
+        for token in self._pattern.findall(text):
+            token = token.lstrip("$")
+            sym = token.upper() if token.upper() in self.coins else self._names.get(token.lower())
+            if sym and sym not in found:
+                found.append(sym)
+        return found
+
+
+symbol_matcher = SymbolMatcher()
+
+
+async def question_context(question: str) -> str:
+    """Facts for ask_ai about the coins a question mentions; empty if none.
+
+    Quotes come from the in-memory cache and headlines from the news archive;
+    a question never calls or refreshes CoinMarketCap or DuckDuckGo.
+    """
+    symbols = await symbol_matcher.match(question)
+    if not symbols:
+        return ""
+    coins = [symbol_matcher.coins[sym] for sym in symbols]
+    quotes, fetched_at = await services.get_cached_quotes(coins, refresh=False)
+    try:
+        indicators = await indicator_engine.snapshot(symbols)
+    except Exception as e:
+        logger.warning("Indicators unavailable for chat context: %s", e)
+        indicators = {}
+
+    lines = []
+    if quotes:
+        age = int((time.time() - fetched_at) // 60)
+        lines.append(f"Котировки CoinMarketCap ({age} мин назад):")
+    since = time.time() - HEADLINE_HOURS * 3600
+    for sym in symbols:
+        data = quotes.get(sym)
+        if data:
+            line = services.format_quote_line(sym, data)
+            extra = services.format_indicators(indicators.get(sym, {}))
+            lines.append(f"{line}; {extra}" if extra else line)
+        try:
+            headlines = await db.recent_news(sym, "news", since, HEADLINES_PER_COIN)
+        except Exception as e:
+            logger.warning("News archive unavailable for chat context: %s", e)
+            headlines = []
+        if headlines:
+            lines.append(f"Свежие заголовки {sym}:")
+            lines.extend(f"- {h['title']} ({h['url']})" for h in headlines)
+    return "\n".join(lines)
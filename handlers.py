@@ -1,21 +1,39 @@
+import functools
+import html
 import logging
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+import re
+import time
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from config import EVM_ADDRESS
+from admission import ai_user_limiter, QueueFull
+from conversations import conversations
+from states import user_states
 import db
+import export
+import grounding
 import services
+from tg_html import render_chunks, strip_tags
 
 logger = logging.getLogger(__name__)
 
-user_states: dict[int, dict] = {}
-
 BTN_SUMMARY = "Сводка"
 BTN_COINS = "Монеты"
 BTN_SUPPORT = "Поддержать"
 BTN_HELP = "Помощь"
 BTN_ADMIN = "Админ"
 
+USERS_PAGE_SIZE = 25
+INLINE_CACHE_SECONDS = 30
+
 WELCOME_TEXT = (
     "<b>Добро пожаловать в Крипто Сводка Бот!</b>\n\n"
     "Этот бот предоставляет ежедневные сводки по отслеживаемым криптовалютам "
@@ -26,8 +44,10 @@ WELCOME_TEXT = (
 HELP_TEXT = (
     "<b>Крипто Сводка Бот - Помощь</b>\n\n"
     "<b>Команды:</b>\n"
-    "/start - Запустить бота\n"
+    "/start - Запустить бота (и начать диалог с AI заново)\n"
     "/summary - Получить текущую сводку\n"
+    "/price [SYMBOL] - Быстрые цены без AI-анализа\n"
+    "/news [SYMBOL] [7d] запрос - Поиск по архиву новостей\n"
     "/coins - Список отслеживаемых монет\n"
     "/support - Поддержать проект\n"
     "/help - Показать эту справку\n"
@@ -63,37 +83,37 @@ def get_admin_inline_keyboard():
             [InlineKeyboardButton("Аналитика пользователей", callback_data="admin_analytics")],
             [InlineKeyboardButton("Список пользователей", callback_data="admin_users")],
             [InlineKeyboardButton("Добавить монету", callback_data="admin_add_coin")],
+            [InlineKeyboardButton("Добавить несколько монет", callback_data="admin_add_coins")],
             [InlineKeyboardButton("Удалить монету", callback_data="admin_remove_coin")],
+            [InlineKeyboardButton("Экспорт данных", callback_data="admin_export")],
         ]
     )
 
 
+def format_users_list(users: list[dict]) -> str:
+    text = ""
+    for u in users:
+        name = html.escape(u["first_name"] or u["username"] or str(u["telegram_id"]))
+        status = "админ" if u["is_admin"] else ("авторизован" if u["is_authenticated"] else "ожидает")
+        text += f"- {name} (ID: <code>{u['telegram_id']}</code>) [{status}]\n"
+    return text
+
+
 async def split_send(update_or_chat, text: str, context: ContextTypes.DEFAULT_TYPE = None, chat_id: int = None):
-    max_len = 4000
-    parts = []
-    while text:
-        if len(text) <= max_len:
-            parts.append(text)
-            break
-        idx = text.rfind("\n", 0, max_len)
-        if idx == -1:
-            idx = max_len
-        parts.append(text[:idx])
-        text = text[idx:].lstrip("\n")
-    for part in parts:
+    if chat_id and context:
+        send = functools.partial(context.bot.send_message, chat_id)
+    elif hasattr(update_or_chat, "message") and update_or_chat.message:
+        send = update_or_chat.message.reply_text
+    elif hasattr(update_or_chat, "callback_query") and update_or_chat.callback_query:
+        send = update_or_chat.callback_query.message.reply_text
+    else:
+        return
+    for part in render_chunks(text):
         try:
-            if chat_id and context:
-                await context.bot.send_message(chat_id=chat_id, text=part, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            elif hasattr(update_or_chat, "message") and update_or_chat.message:
-                await update_or_chat.message.reply_text(part, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            elif hasattr(update_or_chat, "callback_query") and update_or_chat.callback_query:
-                await update_or_chat.callback_query.message.reply_text(part, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            await send(part, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
         except Exception as e:
             logger.error("Failed to send message: %s", e)
-            if chat_id and context:
-                await context.bot.send_message(chat_id=chat_id, text=part, disable_web_page_preview=True)
-            elif hasattr(update_or_chat, "message") and update_or_chat.message:
-                await update_or_chat.message.reply_text(part, disable_web_page_preview=True)
+            await send(strip_tags(part), disable_web_page_preview=True)
 
 
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -101,6 +121,7 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await db.get_or_create_user(user.id, user.username, user.first_name)
     await db.authenticate_user(user.id)
     await db.log_action(user.id, "start")
+    conversations.clear(user.id)
     admin = await db.is_admin(user.id)
     await update.message.reply_text(
         WELCOME_TEXT,
@@ -127,6 +148,95 @@ async def summary_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.edit_text(f"Ошибка генерации сводки: {e}")
 
 
+def _format_age(fetched_at: float) -> str:
+    minutes = int((time.time() - fetched_at) // 60)
+    if minutes < 1:
+        return "только что"
+    if minutes < 60:
+        return f"{minutes} мин назад"
+    return f"{minutes // 60} ч {minutes % 60} мин назад"
+
+
+async def price_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    await db.log_action(uid, "price")
+    coins = await db.get_active_coins()
+    if context.args:
+        wanted = context.args[0].upper()
+        coins = [c for c in coins if c["symbol"] == wanted]
+        if not coins:
+            await update.message.reply_text(f"Монета {html.escape(wanted)} не отслеживается. Список: /coins")
+            return
+    if not coins:
+        await update.message.reply_text("Нет отслеживаемых монет.")
+        return
+    quotes, fetched_at = await services.get_cached_quotes(coins)
+    if not quotes:
+        await update.message.reply_text("Цены пока недоступны, попробуйте позже.")
+        return
+    blocks = [services.format_price_block(sym, data) for sym, data in quotes.items()]
+    text = "\n".join(b for b in blocks if b)
+    text += f"\n<i>CoinMarketCap, обновлено {_format_age(fetched_at)}</i>"
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+
+async def inline_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    wanted = query.query.strip().upper()
+    coins = [c for c in await db.get_active_coins() if c["symbol"].startswith(wanted)]
+    quotes, fetched_at = await services.get_cached_quotes(coins) if coins else ({}, None)
+    results = []
+    for sym, data in quotes.items():
+        block = services.format_price_block(sym, data)
+        results.append(
+            InlineQueryResultArticle(
+                id=sym,
+                title=services.format_price_headline(sym, data),
+                description=f"CoinMarketCap, {_format_age(fetched_at)}",
+                input_message_content=InputTextMessageContent(block, parse_mode=ParseMode.HTML),
+            )
+        )
+    await query.answer(results, cache_time=INLINE_CACHE_SECONDS)
+
+
+NEWS_RESULTS = 10
+NEWS_PERIOD_RE = re.compile(r"^(\d{1,3})([dhдч])$", re.IGNORECASE)
+
+
+async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    await db.log_action(uid, "news")
+    symbols = {c["symbol"] for c in await db.get_active_coins()}
+    symbol = None
+    since = 0
+    words = []
+    for arg in context.args or []:
+        period = NEWS_PERIOD_RE.match(arg)
+        if period:
+            hours = int(period.group(1)) * (24 if period.group(2).lower() in "dд" else 1)
+            since = time.time() - hours * 3600
+        elif arg.upper() in symbols and symbol is None:
+            symbol = arg.upper()
+        else:
+            words.append(arg)
+    if not words and not symbol:
+        await update.message.reply_text(
+            "Использование: /news [SYMBOL] [7d] запрос\nНапример: /news OWB листинг или /news RNBW 3d"
+        )
+        return
+    items = await db.search_news(" ".join(words), symbol=symbol, since=since, limit=NEWS_RESULTS)
+    if not items:
+        await update.message.reply_text("В архиве ничего не найдено.")
+        return
+    lines = ["<b>Архив новостей:</b>\n"]
+    for item in items:
+        lines.append(
+            f"- <b>{item['symbol']}</b> <a href=\"{html.escape(item['url'])}\">{html.escape(item['title'])}</a> "
+            f"<i>({_format_age(item['fetched_at'])})</i>"
+        )
+    await split_send(update, "\n".join(lines))
+
+
 async def coins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     await db.log_action(uid, "coins")
@@ -175,6 +285,54 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def bulk_add_coins(update: Update, uid: int, text: str):
+    tokens = list({t.lower(): t for t in re.split(r"[\s,;]+", text) if t}.values())
+    if not tokens:
+        await update.message.reply_text(
+            "Укажите символы или CMC slug через пробел или запятую, например:\n"
+            "<code>/addcoins BTC ethereum SOL</code>",
+            parse_mode=ParseMode.HTML,
+        )
+        return
+    async def on_loading():
+        await update.message.reply_text("Загружаю справочник CoinMarketCap, это разовая операция...")
+
+    if not await services.ensure_cmc_map(on_loading):
+        await update.message.reply_text(
+            "Справочник CoinMarketCap недоступен (нет CMC_API_KEY или ошибка загрузки). "
+            "Попробуйте позже или добавьте монету по одной через админ-панель."
+        )
+        return
+    resolved = await db.resolve_cmc_tokens(tokens)
+    found = []
+    for coin in resolved.values():
+        # coins.symbol is unique: the first token resolving to a symbol wins.
+        if coin and all(c["symbol"] != coin["symbol"] for c in found):
+            found.append(coin)
+    missing = [t for t, c in resolved.items() if not c]
+    if found:
+        existing = await db.add_coins_bulk(found)
+        await db.log_action(uid, "admin_add_coins", ",".join(c["symbol"] for c in found))
+    text = ""
+    if found:
+        text += "<b>Добавлены:</b>\n" + "\n".join(
+            f"- <b>{c['symbol']}</b> ({html.escape(c['name'])}, CMC: {c['slug']})"
+            + (f" — уже отслеживается как <b>{existing[c['cmc_id']]}</b>" if c["cmc_id"] in existing else "")
+            for c in found
+        )
+    if missing:
+        text += "\n\n<b>Не найдены на CoinMarketCap:</b> " + html.escape(", ".join(missing))
+    await update.message.reply_text(text.strip(), parse_mode=ParseMode.HTML)
+
+
+async def addcoins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    if not await db.is_admin(uid):
+        await update.message.reply_text("Доступ запрещён. Только для админов.")
+        return
+    await bulk_add_coins(update, uid, " ".join(context.args or []))
+
+
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -203,6 +361,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "<b>Аналитика пользователей</b>\n\n"
             f"Всего пользователей: {stats['total_users']}\n"
             f"Авторизованных: {stats['authenticated_users']}\n"
+            f"Заблокировали бота: {stats['blocked_users']}\n"
             f"Активных за 24ч: {stats['active_24h']}\n"
             f"Активных за 7д: {stats['active_7d']}\n"
             f"Активных за 30д: {stats['active_30d']}\n"
@@ -211,30 +370,62 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         for action, count in stats["top_actions_week"]:
             text += f"  {action}: {count}\n"
+        last = stats["last_broadcast"]
+        if last:
+            text += (
+                f"\n<b>Последняя рассылка</b> ({last['kind']}, {last['started_at']} UTC):\n"
+                f"  доставлено: {last['sent']}, ошибок: {last['failed']}, отключено: {last['pruned']}\n"
+            )
         await query.edit_message_text(text, parse_mode=ParseMode.HTML)
 
-    elif data == "admin_users":
-        await db.log_action(uid, "admin_users_list")
-        users = await db.get_all_users_list()
-        if not users:
+    elif data == "admin_users" or data.startswith("users_page:"):
+        if data == "admin_users":
+            await db.log_action(uid, "admin_users_list")
+            users, has_older, has_newer = await db.get_users_page(limit=USERS_PAGE_SIZE)
+        else:
+            _, direction, cursor = data.split(":")
+            if direction == "older":
+                users, has_older, has_newer = await db.get_users_page(after_id=int(cursor), limit=USERS_PAGE_SIZE)
+            else:
+                users, has_older, has_newer = await db.get_users_page(before_id=int(cursor), limit=USERS_PAGE_SIZE)
+        if not users and data == "admin_users":
             await query.edit_message_text("Пользователей пока нет.")
             return
-        text = "<b>Все пользователи:</b>\n\n"
-        for u in users[:50]:
-            name = u["first_name"] or u["username"] or str(u["telegram_id"])
-            status = "админ" if u["is_admin"] else ("авторизован" if u["is_authenticated"] else "ожидает")
-            text += f"- {name} (ID: <code>{u['telegram_id']}</code>) [{status}]\n"
-        if len(users) > 50:
-            text += f"\n... и ещё {len(users) - 50}"
-        await query.edit_message_text(text, parse_mode=ParseMode.HTML)
+        nav = []
+        if has_newer and users:
+            nav.append(InlineKeyboardButton("« Новее", callback_data=f"users_page:newer:{users[0]['id']}"))
+        if has_older and users:
+            nav.append(InlineKeyboardButton("Старее »", callback_data=f"users_page:older:{users[-1]['id']}"))
+        keyboard = [nav] if nav else []
+        keyboard.append([InlineKeyboardButton("Поиск по ID / username", callback_data="users_search")])
+        await query.edit_message_text(
+            "<b>Все пользователи:</b>\n\n" + format_users_list(users),
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+
+    elif data == "users_search":
+        await user_states.set(uid, {"state": "searching_users"})
+        await query.edit_message_text(
+            "Введите <b>Telegram ID</b> или начало <b>username</b>:",
+            parse_mode=ParseMode.HTML,
+        )
 
     elif data == "admin_add_coin":
-        user_states[uid] = {"state": "adding_coin_symbol"}
+        await user_states.set(uid, {"state": "adding_coin_symbol"})
         await query.edit_message_text(
             "Введите <b>символ</b> монеты (например, BTC, ETH):",
             parse_mode=ParseMode.HTML,
         )
 
+    elif data == "admin_add_coins":
+        await user_states.set(uid, {"state": "bulk_adding_coins"})
+        await query.edit_message_text(
+            "Отправьте символы или CMC slug монет через пробел или запятую "
+            "(например: <code>BTC ethereum SOL</code>):",
+            parse_mode=ParseMode.HTML,
+        )
+
     elif data == "admin_remove_coin":
         coins = await db.get_active_coins()
         if not coins:
@@ -260,6 +451,29 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.HTML,
         )
 
+    elif data == "admin_export":
+        keyboard = [
+            [
+                InlineKeyboardButton(f"{table} ({fmt.upper()})", callback_data=f"export:{table}:{fmt}")
+                for fmt in export.EXPORT_FORMATS
+            ]
+            for table in db.EXPORT_COLUMNS
+        ]
+        keyboard.append([InlineKeyboardButton("Отмена", callback_data="admin_cancel")])
+        await query.edit_message_text(
+            "Что выгрузить? Файл придёт сжатым (gzip).",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+
+    elif data.startswith("export:"):
+        _, table, fmt = data.split(":")
+        if table not in db.EXPORT_COLUMNS or fmt not in export.EXPORT_FORMATS:
+            return
+        await db.log_action(uid, "admin_export", f"{table}.{fmt}")
+        await query.edit_message_text(f"Готовлю выгрузку {table} ({fmt})...")
+        # Off the update path: a large export must not hold up other users.
+        context.application.create_task(export.send_export(context.bot, uid, table, fmt), update=update)
+
     elif data == "admin_cancel":
         await query.edit_message_text("Отменено.")
 
@@ -274,11 +488,23 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await db.is_authenticated(uid):
         await db.authenticate_user(uid)
 
-    state = user_states.get(uid)
+    state = await user_states.get(uid)
     if state:
         st = state.get("state")
-        if st == "adding_coin_symbol":
-            user_states[uid] = {"state": "adding_coin_name", "symbol": text.upper()}
+        if st == "searching_users":
+            await user_states.delete(uid)
+            users = await db.search_users(text, limit=USERS_PAGE_SIZE)
+            await update.message.reply_text(
+                "<b>Найдено:</b>\n\n" + format_users_list(users) if users else "Никого не найдено.",
+                parse_mode=ParseMode.HTML,
+            )
+            return
+        elif st == "bulk_adding_coins":
+            await user_states.delete(uid)
+            await bulk_add_coins(update, uid, text)
+            return
+        elif st == "adding_coin_symbol":
+            await user_states.set(uid, {"state": "adding_coin_name", "symbol": text.upper()})
             await update.message.reply_text(
                 f"Символ: <b>{text.upper()}</b>\nТеперь введите <b>название</b> монеты:",
                 parse_mode=ParseMode.HTML,
@@ -287,7 +513,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif st == "adding_coin_name":
             symbol = state["symbol"]
             name = text
-            user_states[uid] = {"state": "adding_coin_slug", "symbol": symbol, "name": name}
+            await user_states.set(uid, {"state": "adding_coin_slug", "symbol": symbol, "name": name})
             await update.message.reply_text(
                 f"Символ: <b>{symbol}</b>, Название: <b>{name}</b>\n"
                 "Введите <b>CMC slug</b> (часть URL на CoinMarketCap, например <code>bitcoin</code> для bitcoin).\n"
@@ -301,10 +527,14 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             slug = text.strip().lower() if text.strip() != "-" else None
             await db.add_coin(symbol, name, slug)
             await db.log_action(uid, "admin_add_coin", f"{symbol} - {name} (slug: {slug})")
-            del user_states[uid]
+            await user_states.delete(uid)
             slug_msg = f" (CMC slug: {slug})" if slug else ""
+            # Resolves and stores the CMC id right away, so a wrong slug shows up now
+            # and later summaries fetch this coin through the id batch.
+            quote = (await services.get_crypto_quotes([{"symbol": symbol, "cmc_slug": slug}])).get(symbol, {})
+            warning = f"\n⚠️ {quote['error']}" if "error" in quote else ""
             await update.message.reply_text(
-                f"Монета <b>{symbol}</b> ({name}){slug_msg} добавлена!",
+                f"Монета <b>{symbol}</b> ({name}){slug_msg} добавлена!{warning}",
                 parse_mode=ParseMode.HTML,
                 reply_markup=get_main_keyboard(True),
             )
@@ -321,55 +551,28 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text == BTN_ADMIN:
         return await admin_cmd(update, context)
 
+    allowed, retry_after = ai_user_limiter.allow(uid)
+    if not allowed:
+        await update.message.reply_text(
+            f"Слишком много вопросов. Попробуйте через {int(retry_after) + 1} сек."
+        )
+        return
+
     await db.log_action(uid, "ai_question", text[:100])
     wait_msg = await update.message.reply_text("Думаю...")
+
+    async def on_queued(position: int):
+        await wait_msg.edit_text(f"Все AI-слоты заняты. Ваше место в очереди: {position}")
+
     try:
-        response = await services.ask_ai(text)
+        context_text = await grounding.question_context(text)
+        response = await services.ask_ai(text, context=context_text, on_queued=on_queued, user_id=uid)
         await wait_msg.delete()
         await split_send(update, response)
+    except QueueFull:
+        await db.log_action(uid, "ai_rejected")
+        await wait_msg.edit_text("Сервер перегружен, попробуйте чуть позже.")
     except Exception as e:
         logger.error("AI question failed: %s", e)
         await wait_msg.edit_text(f"Ошибка: {e}")
 
-
-async def scheduled_summary(context: ContextTypes.DEFAULT_TYPE):
-    logger.info("Запуск запланированной сводки...")
-    try:
-        summary = await services.generate_full_summary()
-        users = await db.get_authenticated_users()
-        sent = 0
-        failed = 0
-        for user in users:
-            try:
-                parts = []
-                text = summary
-                while text:
-                    if len(text) <= 4000:
-                        parts.append(text)
-                        break
-                    idx = text.rfind("\n", 0, 4000)
-                    if idx == -1:
-                        idx = 4000
-                    parts.append(text[:idx])
-                    text = text[idx:].lstrip("\n")
-                for part in parts:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user["telegram_id"],
-                            text=part,
-                            parse_mode=ParseMode.HTML,
-                            disable_web_page_preview=True,
-                        )
-                    except Exception:
-                        await context.bot.send_message(
-                            chat_id=user["telegram_id"],
-                            text=part,
-                            disable_web_page_preview=True,
-                        )
-                sent += 1
-            except Exception as e:
-                logger.error("Failed to send to %s: %s", user["telegram_id"], e)
-                failed += 1
-        logger.info("Scheduled summary sent to %d users, %d failed", sent, failed)
-    except Exception as e:
-        logger.error("Scheduled summary generation failed: %s", e)
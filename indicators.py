@@ -0,0 +1,174 @@
+import logging
+import math
+import time
+from collections import deque
+
+import db
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+MA_SHORT = 24
+MA_LONG = 168
+RSI_PERIOD = 14
+VOL_WINDOW = 24
+VOLUME_WINDOW = 168
+HISTORY_DAYS = 30
+
+
+class RollingWindow:
+    # Running sum and sum of squares over the last `size` values, so mean and stdev
+    # are O(1) per sample. The newest push can be undone once, which is how a
+    # second quote within the same hour replaces the first.
+    __slots__ = ("size", "values", "total", "total_sq", "_evicted", "_pushes")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values: deque[float] = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._evicted = None
+        self._pushes = 0
+
+    def push(self, x: float):
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        self._evicted = None
+        if len(self.values) > self.size:
+            self._evicted = self.values.popleft()
+            self.total -= self._evicted
+            self.total_sq -= self._evicted * self._evicted
+        self._pushes += 1
+        if self._pushes % (self.size * 8) == 0:
+            # Re-add from scratch now and then so float drift cannot accumulate.
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+
+    def undo(self):
+        x = self.values.pop()
+        self.total -= x
+        self.total_sq -= x * x
+        if self._evicted is not None:
+            self.values.appendleft(self._evicted)
+            self.total += self._evicted
+            self.total_sq += self._evicted * self._evicted
+            self._evicted = None
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) >= self.size
+
+    def mean(self) -> float:
+        return self.total / len(self.values)
+
+    def stdev(self) -> float:
+        n = len(self.values)
+        if n < 2:
+            return 0.0
+        return math.sqrt(max(0.0, (self.total_sq - self.total * self.total / n) / (n - 1)))
+
+
+class SymbolIndicators:
+    # One hourly price/volume series. Gaps are joined: the sampler runs hourly, so
+    # consecutive samples are treated as consecutive hours.
+
+    def __init__(self):
+        self.hour = None
+        self.price = None
+        self.ma_short = RollingWindow(MA_SHORT)
+        self.ma_long = RollingWindow(MA_LONG)
+        self.returns = RollingWindow(VOL_WINDOW)
+        self.volumes = RollingWindow(VOLUME_WINDOW)
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.changes = 0
+        self._undo = None
+
+    def add(self, hour: int, price: float, volume: float | None):
+        if price is None or price <= 0:
+            return
+        if self.hour is not None and hour < self.hour:
+            return
+        if hour == self.hour:
+            self._rollback()
+        self._undo = (self.hour, self.price, self.avg_gain, self.avg_loss, self.changes, volume is not None)
+        self.ma_short.push(price)
+        self.ma_long.push(price)
+        if volume is not None:
+            self.volumes.push(volume)
+        if self.price is not None:
+            self.returns.push(math.log(price / self.price))
+            change = price - self.price
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            self.changes += 1
+            # Wilder smoothing: a plain average until the first full period.
+            n = min(self.changes, RSI_PERIOD)
+            self.avg_gain += (gain - self.avg_gain) / n
+            self.avg_loss += (loss - self.avg_loss) / n
+        self.hour, self.price = hour, price
+
+    def _rollback(self):
+        prev_hour, prev_price, self.avg_gain, self.avg_loss, self.changes, had_volume = self._undo
+        self.ma_short.undo()
+        self.ma_long.undo()
+        if had_volume:
+            self.volumes.undo()
+        if prev_price is not None:
+            self.returns.undo()
+        self.hour, self.price = prev_hour, prev_price
+
+    def snapshot(self) -> dict:
+        result = {}
+        if self.ma_short.full:
+            result["ma_24h"] = self.ma_short.mean()
+        if self.ma_long.full:
+            result["ma_7d"] = self.ma_long.mean()
+            result["price_vs_ma_7d_pct"] = (self.price / result["ma_7d"] - 1) * 100
+        if self.changes >= RSI_PERIOD:
+            result["rsi_14h"] = 100.0 if self.avg_loss == 0 else 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+        if self.returns.full:
+            result["realized_vol_24h_pct"] = self.returns.stdev() * math.sqrt(VOL_WINDOW) * 100
+        if self.volumes.full and self.volumes.stdev() > 0:
+            result["volume_z_7d"] = (self.volumes.values[-1] - self.volumes.mean()) / self.volumes.stdev()
+        return result
+
+
+class IndicatorEngine:
+    def __init__(self):
+        self.series: dict[str, SymbolIndicators] = {}
+        self._warm = False
+
+    async def _warm_up(self):
+        if self._warm:
+            return
+        since = int(time.time() // HOUR) - HISTORY_DAYS * 24
+        for symbol, hour, price, volume in await db.load_price_history(since):
+            self.series.setdefault(symbol, SymbolIndicators()).add(hour, price, volume)
+        self._warm = True
+
+    async def observe(self, quotes: dict, fetched_at: float):
+        await self._warm_up()
+        hour = int(fetched_at // HOUR)
+        rows = []
+        for symbol, data in quotes.items():
+            price = data.get("price")
+            if price is None:
+                continue
+            self.series.setdefault(symbol, SymbolIndicators()).add(hour, price, data.get("volume_24h"))
+            rows.append((symbol, hour, price, data.get("volume_24h")))
+        if rows:
+            await db.save_price_points(rows)
+
+    async def snapshot(self, symbols) -> dict:
+        await self._warm_up()
+        result = {}
+        for symbol in symbols:
+            series = self.series.get(symbol)
+            values = series.snapshot() if series else {}
+            if values:
+                result[symbol] = values
+        return result
+
+
+indicator_engine = IndicatorEngine()
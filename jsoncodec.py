@@ -0,0 +1,34 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson when it is installed, the stdlib otherwise. Both produce compact UTF-8
+# JSON without ASCII escaping, so stored values look the same either way.
+BACKEND = "orjson" if orjson else "json"
+
+if orjson:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data: bytes | str):
+        return orjson.loads(data)
+
+    def dumps_bytes(obj, default=None) -> bytes:
+        return orjson.dumps(obj, default=default, option=_OPTIONS)
+
+    def dumps(obj, default=None) -> str:
+        return orjson.dumps(obj, default=default, option=_OPTIONS).decode()
+
+else:
+
+    def loads(data: bytes | str):
+        return json.loads(data)
+
+    def dumps(obj, default=None) -> str:
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj, default=None) -> bytes:
+        return dumps(obj, default).encode()
+
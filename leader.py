@@ -0,0 +1,90 @@
+import fcntl
+import logging
+import os
+import socket
+import uuid
+
+from config import LEADER_LEASE_SECONDS, LEADER_LOCK_FILE
+import db
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+
+
+class DbLease:
+    # Shared SQLite row with an expiry: the holder renews it on every heartbeat, and
+    # any other instance may take it over once a heartbeat has been missed for ttl.
+
+    def __init__(self, holder: str, ttl: float):
+        self.holder = holder
+        self.ttl = ttl
+
+    async def acquire(self) -> bool:
+        return await db.acquire_lease(LEASE_NAME, self.holder, self.ttl)
+
+    async def release(self):
+        await db.release_lease(LEASE_NAME, self.holder)
+
+
+class FileLease:
+    # Local stand-in for running several instances on one machine: an flock that
+    # the kernel drops as soon as the holding process dies.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    async def acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    async def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class Leader:
+    def __init__(self, lease):
+        self.lease = lease
+        self.is_leader = False
+
+    async def heartbeat(self):
+        try:
+            held = await self.lease.acquire()
+        except Exception as e:
+            # If we cannot renew, assume someone else will take over once it expires.
+            logger.warning("Leader lease heartbeat failed: %s", e)
+            held = False
+        if held != self.is_leader:
+            logger.info("Leadership %s by %s", "acquired" if held else "lost", instance_id)
+        self.is_leader = held
+        return held
+
+    async def release(self):
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self.lease.release()
+            except Exception as e:
+                logger.warning("Leader lease release failed: %s", e)
+
+
+instance_id = f"{os.getenv('FLY_MACHINE_ID') or socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+leader = Leader(
+    FileLease(LEADER_LOCK_FILE) if LEADER_LOCK_FILE else DbLease(instance_id, LEADER_LEASE_SECONDS)
+)
+
+
+async def heartbeat_job(context):
+    await leader.heartbeat()
@@ -1,28 +1,13 @@
+from startup import startup_timer
+
 import asyncio
-import json
+import functools
 import logging
 import os
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import threading
 
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-
-from config import BOT_TOKEN
-from db import init_db
-import db
-import services
-from handlers import (
-    start_cmd,
-    help_cmd,
-    summary_cmd,
-    coins_cmd,
-    support_cmd,
-    myid_cmd,
-    admin_cmd,
-    callback_handler,
-    text_handler,
-)
+from config import BOT_TOKEN, WORKERS, UPDATE_CONCURRENCY
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -32,44 +17,65 @@ logger = logging.getLogger(__name__)
 
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
 WEBHOOK_PATH = "/webhook"
+READY_TIMEOUT = 30
+DEDUP_FLUSH_SECONDS = 5
+BOT_POOL_SIZE = 256
 bot_loop = None
 bot_application = None
+worker_pool = None
+bot_ready = threading.Event()
+TRIGGER_TIMEOUT = 180
+TRIGGER_REPLIES = {
+    "sent": (200, b"Summary sent"),
+    "not_leader": (409, b"Not the leader instance"),
+    "claimed": (409, b"Summary already triggered this minute"),
+    "failed": (500, b"Error"),
+}
 
 
 class WebhookHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == "/trigger" and bot_loop and bot_application:
+        if self.path == "/trigger" and bot_ready.wait(READY_TIMEOUT):
             import asyncio as _aio
             try:
-                future = _aio.run_coroutine_threadsafe(
-                    _run_trigger_summary(), bot_loop
-                )
-                future.result(timeout=180)
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(b"Summary sent")
+                if worker_pool:
+                    outcome = worker_pool.trigger_summary(TRIGGER_TIMEOUT)
+                else:
+                    future = _aio.run_coroutine_threadsafe(
+                        _run_trigger_summary(bot_application.bot), bot_loop
+                    )
+                    outcome = future.result(timeout=TRIGGER_TIMEOUT)
             except Exception as exc:
                 logger.error("Trigger summary failed: %s", exc)
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Error")
+                outcome = "failed"
+            status, body = TRIGGER_REPLIES[outcome]
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(body)
         else:
             self.send_response(200)
             self.end_headers()
             self.wfile.write(b"OK")
 
     def do_POST(self):
-        if self.path == WEBHOOK_PATH and bot_loop and bot_application:
+        # The port is bound before the bot is built, so early updates wait here
+        # instead of being refused while the machine is still starting.
+        if self.path == WEBHOOK_PATH and bot_ready.wait(READY_TIMEOUT):
             import asyncio as _aio
+            from telegram import Update
+            import jsoncodec
             try:
                 length = int(self.headers.get("Content-Length", 0))
                 body = self.rfile.read(length)
-                data = json.loads(body)
-                update = Update.de_json(data, bot_application.bot)
-                future = _aio.run_coroutine_threadsafe(
-                    bot_application.process_update(update), bot_loop
-                )
-                future.result(timeout=30)
+                data = jsoncodec.loads(body)
+                if worker_pool:
+                    worker_pool.dispatch(data)
+                else:
+                    update = Update.de_json(data, bot_application.bot)
+                    future = _aio.run_coroutine_threadsafe(
+                        bot_application.process_update(update), bot_loop
+                    )
+                    future.result(timeout=30)
             except Exception as e:
                 logger.error("Webhook processing error: %s", e)
             self.send_response(200)
@@ -83,98 +89,221 @@ class WebhookHandler(BaseHTTPRequestHandler):
         pass
 
 
-async def _run_trigger_summary():
+def _start_http_server():
+    port = int(os.getenv("PORT", "8080"))
+    server = HTTPServer(("0.0.0.0", port), WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("HTTP сервер на порту %d", port)
+    return server
+
+
+async def _run_trigger_summary(bot) -> str:
+    # Gated like the scheduled slots: only the leader broadcasts, and the claim keeps
+    # a retried or repeated trigger within the same minute from sending twice.
+    from datetime import datetime
+
+    import db
+    import services
+    from broadcast import broadcast_summary
+    from leader import leader, instance_id
+
+    if not leader.is_leader:
+        logger.info("/trigger ignored: this instance is not the leader")
+        return "not_leader"
+    if not await db.claim_slot(f"trigger:{datetime.utcnow():%Y-%m-%dT%H:%M}", instance_id):
+        logger.info("/trigger ignored: already claimed this minute")
+        return "claimed"
     logger.info("Запуск сводки через /trigger...")
     try:
         summary = await services.generate_full_summary()
-        users = await db.get_authenticated_users()
-        sent = 0
-        for user in users:
-            try:
-                text = summary
-                while text:
-                    chunk = text[:4000]
-                    if len(text) > 4000:
-                        idx = chunk.rfind("\n")
-                        if idx > 0:
-                            chunk = text[:idx]
-                        text = text[len(chunk):].lstrip("\n")
-                    else:
-                        text = ""
-                    try:
-                        await bot_application.bot.send_message(
-                            chat_id=user["telegram_id"], text=chunk,
-                            parse_mode="HTML", disable_web_page_preview=True,
-                        )
-                    except Exception:
-                        await bot_application.bot.send_message(
-                            chat_id=user["telegram_id"], text=chunk,
-                            disable_web_page_preview=True,
-                        )
-                sent += 1
-            except Exception as e:
-                logger.error("Ошибка отправки %s: %s", user["telegram_id"], e)
-        logger.info("Сводка отправлена %d пользователям", sent)
+        await broadcast_summary(bot, summary, kind="trigger")
     except Exception as e:
         logger.error("Ошибка генерации сводки: %s", e)
+        return "failed"
+    return "sent"
 
 
-def _build_app():
-    app = Application.builder().token(BOT_TOKEN).build()
+@functools.cache
+def _json_codec_request_class():
+    # Built on first use so that importing main does not load PTB.
+    from telegram.error import TelegramError
+    from telegram.request import HTTPXRequest
+    import jsoncodec
+
+    class JsonCodecRequest(HTTPXRequest):
+        # Bot API responses are decoded with the JSON codec instead of the stdlib.
+        def parse_json_payload(self, payload: bytes) -> dict:
+            try:
+                return jsoncodec.loads(payload)
+            except ValueError as e:
+                raise TelegramError("Invalid server response") from e
+
+    return JsonCodecRequest
+
+
+def _build_app(scheduled_jobs: bool = True, request=None):
+    from telegram.ext import (
+        Application,
+        CommandHandler,
+        MessageHandler,
+        CallbackQueryHandler,
+        InlineQueryHandler,
+        TypeHandler,
+        filters,
+    )
+    from telegram import Update
+    from dedup import dedup_guard, flush_job
+    from ordering import ChatOrderedProcessor
+    from scheduler import register_summary_jobs, register_maintenance_jobs, register_leader_heartbeat
+    from handlers import (
+        start_cmd,
+        help_cmd,
+        summary_cmd,
+        price_cmd,
+        news_cmd,
+        inline_price,
+        coins_cmd,
+        support_cmd,
+        myid_cmd,
+        admin_cmd,
+        addcoins_cmd,
+        callback_handler,
+        text_handler,
+    )
+
+    startup_timer.mark("imports")
+    JsonCodecRequest = _json_codec_request_class()
+
+    builder = Application.builder().token(BOT_TOKEN)
+    if request is None:
+        request = JsonCodecRequest(connection_pool_size=BOT_POOL_SIZE)
+        builder = builder.get_updates_request(JsonCodecRequest())
+    builder = builder.request(request).concurrent_updates(ChatOrderedProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, dedup_guard), group=-1)
     app.add_handler(CommandHandler("start", start_cmd))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("summary", summary_cmd))
+    app.add_handler(CommandHandler("price", price_cmd))
+    app.add_handler(CommandHandler("news", news_cmd))
     app.add_handler(CommandHandler("coins", coins_cmd))
     app.add_handler(CommandHandler("support", support_cmd))
     app.add_handler(CommandHandler("myid", myid_cmd))
     app.add_handler(CommandHandler("admin", admin_cmd))
+    app.add_handler(CommandHandler("addcoins", addcoins_cmd))
     app.add_handler(CallbackQueryHandler(callback_handler))
+    app.add_handler(InlineQueryHandler(inline_price))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    if scheduled_jobs:
+        register_leader_heartbeat(app)
+        register_summary_jobs(app)
+        register_maintenance_jobs(app)
+    app.job_queue.run_repeating(flush_job, interval=DEDUP_FLUSH_SECONDS, name="dedup_flush")
+    startup_timer.mark("build_app")
     return app
 
 
+async def _ensure_webhook(app, webhook_url: str):
+    import db
+
+    if await db.get_meta("webhook_url") == webhook_url:
+        return False
+    await app.bot.set_webhook(url=webhook_url)
+    await db.set_meta("webhook_url", webhook_url)
+    logger.info("Webhook установлен: %s", webhook_url)
+    return True
+
+
+async def _verify_webhook(app, webhook_url: str):
+    # Runs after startup: catches a webhook that was changed behind our back
+    # without putting a Bot API round trip on the cold-start path.
+    import db
+
+    try:
+        info = await app.bot.get_webhook_info()
+        if info.url != webhook_url:
+            logger.warning("Registered webhook %r differs, re-registering", info.url)
+            await app.bot.set_webhook(url=webhook_url)
+            await db.set_meta("webhook_url", webhook_url)
+    except Exception as e:
+        logger.warning("Webhook verification failed: %s", e)
+
+
 async def run_webhook():
     global bot_loop, bot_application
-    app = _build_app()
-    await app.initialize()
-    await app.start()
-    await init_db()
+    import db
+    from dedup import update_dedup
+    from leader import leader
 
-    bot_loop = asyncio.get_event_loop()
-    bot_application = app
+    app = _build_app()
+    await asyncio.gather(app.initialize(), db.init_db())
+    await update_dedup.load()
+    startup_timer.mark("initialize+init_db")
 
     webhook_url = f"https://{WEBHOOK_HOST}{WEBHOOK_PATH}"
-    await app.bot.set_webhook(url=webhook_url)
-    logger.info("Webhook установлен: %s", webhook_url)
+    if not await _ensure_webhook(app, webhook_url):
+        logger.info("Webhook уже установлен: %s", webhook_url)
+    startup_timer.mark("webhook")
 
-    port = int(os.getenv("PORT", "8080"))
-    server = HTTPServer(("0.0.0.0", port), WebhookHandler)
-    threading.Thread(target=server.serve_forever, daemon=True).start()
-    logger.info("HTTP сервер на порту %d", port)
+    await app.start()
+    bot_loop = asyncio.get_running_loop()
+    bot_application = app
+    bot_ready.set()
+    startup_timer.mark("start")
+    startup_timer.report()
+    verify_task = asyncio.create_task(_verify_webhook(app, webhook_url))
 
     try:
         await asyncio.Event().wait()
     finally:
+        verify_task.cancel()
+        await update_dedup.flush()
+        await leader.release()
         await app.stop()
         await app.shutdown()
 
 
+def run_workers():
+    # The front process only parses and routes webhook updates; the bot itself
+    # runs in WORKERS processes, sharded by chat id.
+    global worker_pool
+    import db
+    from workers import WorkerPool
+
+    asyncio.run(db.init_db())
+    startup_timer.mark("init_db")
+    worker_pool = WorkerPool(WORKERS)
+    worker_pool.start()
+    bot_ready.set()
+    startup_timer.mark("workers")
+    startup_timer.report()
+    worker_pool.monitor()
+
+
 def run_polling():
-    global bot_loop, bot_application
+    import db
+    from dedup import update_dedup
+    from leader import leader
 
-    async def _post_init(application: Application):
+    async def _post_init(application):
         global bot_loop, bot_application
-        bot_loop = asyncio.get_event_loop()
+        await db.init_db()
+        # run_polling drops the webhook, so the cached registration is no longer valid.
+        await db.set_meta("webhook_url", "")
+        await update_dedup.load()
+        bot_loop = asyncio.get_running_loop()
         bot_application = application
-        await init_db()
+        bot_ready.set()
+        startup_timer.mark("init_db")
+        startup_timer.report()
+
+    async def _post_shutdown(application):
+        await update_dedup.flush()
+        await leader.release()
 
     app = _build_app()
     app.post_init = _post_init
-
-    threading.Thread(
-        target=lambda: HTTPServer(("0.0.0.0", int(os.getenv("PORT", "8080"))), WebhookHandler).serve_forever(),
-        daemon=True,
-    ).start()
+    app.post_shutdown = _post_shutdown
 
     logger.info("Бот запускается в режиме polling...")
     app.run_polling(drop_pending_updates=True)
@@ -185,7 +314,13 @@ def main():
         logger.error("BOT_TOKEN is not set!")
         return
 
-    if WEBHOOK_HOST:
+    _start_http_server()
+    startup_timer.mark("http_server")
+
+    if WEBHOOK_HOST and WORKERS > 0:
+        logger.info("Бот запускается в режиме webhook (%s), воркеров: %d...", WEBHOOK_HOST, WORKERS)
+        run_workers()
+    elif WEBHOOK_HOST:
         logger.info("Бот запускается в режиме webhook (%s)...", WEBHOOK_HOST)
         asyncio.run(run_webhook())
     else:
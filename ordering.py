@@ -0,0 +1,46 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update) -> int | None:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    return user.id if user is not None else None
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    # Up to max_concurrent_updates updates run at once, but never two from the same
+    # chat: a slow /summary or AI answer only holds up its own chat, and a dialog's
+    # steps are still handled in the order they arrived. asyncio.Lock wakes waiters
+    # first come, first served. An update waiting for its chat holds a slot, so the
+    # limit should be well above what a single chat sends at once.
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats: dict[int, list] = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = chat_key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
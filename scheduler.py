@@ -0,0 +1,213 @@
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+
+from config import (
+    MORNING_HOUR_UTC,
+    EVENING_HOUR_UTC,
+    SUMMARY_LEAD_MINUTES,
+    SUMMARY_INPUTS_WAIT_SECONDS,
+    ANALYTICS_RETENTION_DAYS,
+    MAINTENANCE_HOUR_UTC,
+    LEADER_LEASE_SECONDS,
+    NEWS_RETENTION_DAYS,
+)
+from broadcast import broadcast_summary
+from leader import leader, instance_id, heartbeat_job
+import db
+import indicators
+import services
+
+logger = logging.getLogger(__name__)
+
+RETENTION_BATCH = 1000
+RETENTION_PAUSE = 0.2
+VACUUM_STEP_PAGES = 200
+VACUUM_MAX_PAGES = 2000
+
+
+class SummarySlot:
+    def __init__(self, name: str, hour: int):
+        self.name = name
+        self.hour = hour
+        self.task: asyncio.Task | None = None
+        self.inputs: dict | None = None
+        self.inputs_ready = asyncio.Event()
+        self.text: str | None = None
+
+    def deliver_time(self) -> time:
+        return time(self.hour, 0, tzinfo=timezone.utc)
+
+    def prepare_time(self) -> time:
+        at = datetime(2000, 1, 2, self.hour) - timedelta(minutes=SUMMARY_LEAD_MINUTES)
+        return time(at.hour, at.minute, tzinfo=timezone.utc)
+
+    def start(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.inputs = None
+        self.inputs_ready = asyncio.Event()
+        self.text = None
+        self.task = asyncio.create_task(self._prepare())
+
+    async def _prepare(self):
+        started = datetime.utcnow()
+        try:
+            self.inputs = await services.collect_summary_inputs()
+        finally:
+            self.inputs_ready.set()
+        if self.inputs is None:
+            self.text = services.NO_COINS_TEXT
+            return
+        self.text = await services.summarize_inputs(self.inputs, baseline=True)
+        logger.info(
+            "Summary '%s' pre-rendered in %.1fs",
+            self.name, (datetime.utcnow() - started).total_seconds(),
+        )
+
+    async def take(self) -> str | None:
+        if self.task is None:
+            logger.warning("Summary '%s' was not pre-warmed, generating now", self.name)
+            self.start()
+        if self.text is None:
+            # Never hold the slot for the LLM: wait only for the data, then fall back
+            # to the raw price block if the AI text is not ready yet.
+            try:
+                await asyncio.wait_for(self.inputs_ready.wait(), SUMMARY_INPUTS_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                return await self._late(f"inputs not ready after {SUMMARY_INPUTS_WAIT_SECONDS}s")
+            if self.inputs is None and self.task.done() and not self.task.cancelled() and self.task.exception():
+                return await self._late(f"collecting inputs failed: {self.task.exception()}")
+            if self.text is None and self.inputs is not None:
+                logger.warning("AI text for '%s' not ready at slot time, sending raw summary", self.name)
+                self.task.cancel()
+                self.text = services.format_raw_inputs(self.inputs)
+        text = self.text
+        self.task = None
+        return text
+
+    async def _late(self, reason: str) -> str:
+        # Upstreams are slow or failing at slot time: send from the quote cache and
+        # the news archive rather than hold or skip the broadcast.
+        logger.warning("Summary '%s' late: %s, sending from cache", self.name, reason)
+        self.task.cancel()
+        self.task = None
+        inputs = await services.cached_summary_inputs()
+        if inputs is None:
+            return services.NO_COINS_TEXT
+        return services.format_raw_inputs(inputs)
+
+
+async def prepare_job(context):
+    slot: SummarySlot = context.job.data
+    if not leader.is_leader:
+        return
+    logger.info("Pre-warming summary '%s'", slot.name)
+    slot.start()
+
+
+async def deliver_job(context):
+    slot: SummarySlot = context.job.data
+    slot_at = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    if not leader.is_leader:
+        return
+    # The claim guards the window where an expired leader has not noticed yet.
+    if not await db.claim_slot(f"{slot.name}:{slot_at:%Y-%m-%d}", instance_id):
+        logger.info("Summary '%s' for %s already claimed by another instance", slot.name, slot_at)
+        return
+    try:
+        text = await slot.take()
+    except Exception as e:
+        logger.error("Scheduled summary '%s' generation failed: %s", slot.name, e)
+        return
+    if text is None:
+        logger.error("Scheduled summary '%s' produced no text", slot.name)
+        return
+    await broadcast_summary(context.bot, services.with_summary_header(text, slot_at), kind=slot.name)
+
+
+async def analytics_retention_job(context):
+    if not leader.is_leader:
+        return
+    rolled = 0
+    try:
+        while True:
+            n = await db.compact_analytics(ANALYTICS_RETENTION_DAYS, RETENTION_BATCH)
+            rolled += n
+            if n < RETENTION_BATCH:
+                break
+            # Yield between batches so interactive writes are not starved.
+            await asyncio.sleep(RETENTION_PAUSE)
+        news = await db.prune_news(NEWS_RETENTION_DAYS)
+        await db.prune_price_history(
+            int(datetime.now(timezone.utc).timestamp()) // indicators.HOUR - indicators.HISTORY_DAYS * 24
+        )
+        # Small steps, each a short write transaction, so the free list is returned
+        # without holding the write lock for long.
+        freed = 0
+        while freed < VACUUM_MAX_PAGES:
+            step = await db.incremental_vacuum(VACUUM_STEP_PAGES)
+            freed += step
+            if step < VACUUM_STEP_PAGES:
+                break
+            await asyncio.sleep(RETENTION_PAUSE)
+        logger.info(
+            "Retention: rolled up %d events, pruned %d news items, freed %d pages", rolled, news, freed
+        )
+    except Exception as e:
+        logger.error("Analytics retention failed after %d events: %s", rolled, e)
+
+
+async def cmc_map_refresh_job(context):
+    if not leader.is_leader:
+        return
+    try:
+        await services.refresh_cmc_map()
+    except Exception as e:
+        logger.error("CMC map refresh failed: %s", e)
+
+
+async def price_sample_job(context):
+    # Hourly quotes keep the indicator history dense even when nobody asks for prices.
+    if not leader.is_leader:
+        return
+    try:
+        coins = await db.get_active_coins()
+        if coins:
+            await services.get_crypto_quotes(coins)
+    except Exception as e:
+        logger.error("Price sampling failed: %s", e)
+
+
+def register_maintenance_jobs(app):
+    app.job_queue.run_repeating(price_sample_job, interval=indicators.HOUR, first=60, name="price_sample")
+    app.job_queue.run_daily(
+        analytics_retention_job, time(MAINTENANCE_HOUR_UTC, 30, tzinfo=timezone.utc), name="analytics_retention"
+    )
+    app.job_queue.run_daily(
+        cmc_map_refresh_job, time(MAINTENANCE_HOUR_UTC, 0, tzinfo=timezone.utc), name="cmc_map_refresh"
+    )
+
+
+def register_leader_heartbeat(app):
+    # Every instance competes for the lease; only the holder runs the jobs below,
+    # while all of them keep serving interactive updates.
+    app.job_queue.run_repeating(
+        heartbeat_job, interval=max(1, LEADER_LEASE_SECONDS // 3), first=0, name="leader_heartbeat"
+    )
+
+
+def register_summary_jobs(app) -> list[SummarySlot]:
+    slots = [SummarySlot("morning", MORNING_HOUR_UTC), SummarySlot("evening", EVENING_HOUR_UTC)]
+    for slot in slots:
+        app.job_queue.run_daily(
+            prepare_job, slot.prepare_time(), data=slot, name=f"prepare_{slot.name}"
+        )
+        app.job_queue.run_daily(
+            deliver_job, slot.deliver_time(), data=slot, name=f"deliver_{slot.name}"
+        )
+        logger.info(
+            "Summary '%s': prepare at %s UTC, deliver at %s UTC",
+            slot.name, slot.prepare_time().strftime("%H:%M"), slot.deliver_time().strftime("%H:%M"),
+        )
+    return slots
@@ -1,65 +1,84 @@
+import asyncio
+import hashlib
 import httpx
-import json
+import math
 import re
+import time
 import logging
-from html import unescape
+from html.parser import HTMLParser
 from datetime import datetime
-from config import CMC_API_KEY, OPENROUTER_API_KEY, AI_MODEL
+from config import (
+    CMC_API_KEY,
+    OPENROUTER_API_KEY,
+    AI_MODEL,
+    QUOTE_MAX_AGE_SECONDS,
+    NEWS_SEARCH_TIMEOUT,
+    NEWS_FALLBACK_HOURS,
+)
+from admission import ai_gate, QueueFull, PRIORITY_SUMMARY, PRIORITY_CHAT
+from conversations import conversations
+from indicators import indicator_engine
+import jsoncodec
 
 logger = logging.getLogger(__name__)
 
 CMC_BASE = "https://pro-api.coinmarketcap.com"
 OPENROUTER_BASE = "https://openrouter.ai/api/v1"
 REQUEST_TIMEOUT = 30
+CMC_ID_BATCH = 100
+CMC_MAP_PAGE = 5000
+CMC_MAP_RETRY_SECONDS = 600
+FINGERPRINT_PRICE_DIGITS = 3
+CMC_INVALID_ID_RE = re.compile(r'Invalid values? for "id": "([\d,\s]+)"')
+
+_quote_cache: dict[str, tuple[dict, float]] = {}
+_quote_cache_loaded = False
+_cmc_map_failed_at = 0.0
+_quote_refreshes: dict[tuple[str, ...], asyncio.Task] = {}
+_quote_misses: dict[str, float] = {}
 
 
 async def get_crypto_quotes(coins: list[dict]) -> dict:
     if not CMC_API_KEY:
         return {"error": "CMC API key not configured"}
 
-    slugs = [c["cmc_slug"] for c in coins if c.get("cmc_slug")]
-    symbols = [c["symbol"] for c in coins if not c.get("cmc_slug")]
-    slug_to_local = {c["cmc_slug"]: c["symbol"] for c in coins if c.get("cmc_slug")}
+    id_to_local = {c["cmc_id"]: c["symbol"] for c in coins if c.get("cmc_id")}
+    unresolved = [c for c in coins if not c.get("cmc_id")]
     result = {}
     headers = {"X-CMC_PRO_API_KEY": CMC_API_KEY, "Accept": "application/json"}
 
     try:
-        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-            if slugs:
-                resp = await client.get(
-                    f"{CMC_BASE}/v2/cryptocurrency/quotes/latest",
-                    headers=headers,
-                    params={"slug": ",".join(slugs), "convert": "USD"},
-                )
-                data = resp.json()
-                if data.get("status", {}).get("error_code", 0) == 0:
-                    for _cmc_id, coin_data in data.get("data", {}).items():
-                        if isinstance(coin_data, list):
-                            coin_data = coin_data[0]
-                        cmc_slug = coin_data.get("slug", "")
-                        local_sym = slug_to_local.get(cmc_slug, coin_data.get("symbol", ""))
-                        result[local_sym] = _parse_coin_data(coin_data)
-
-            if symbols:
-                resp = await client.get(
-                    f"{CMC_BASE}/v2/cryptocurrency/quotes/latest",
-                    headers=headers,
-                    params={"symbol": ",".join(symbols), "convert": "USD"},
-                )
-                data = resp.json()
-                if data.get("status", {}).get("error_code", 0) == 0:
-                    for sym in symbols:
-                        entries = data.get("data", {}).get(sym, [])
-                        if entries:
-                            coin = entries[0] if isinstance(entries, list) else entries
-                            result[sym] = _parse_coin_data(coin)
-                        else:
-                            result[sym] = {"error": f"Токен {sym} не найден на CoinMarketCap"}
+        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, headers=headers) as client:
+            ids = list(id_to_local)
+            chunks = [ids[i:i + CMC_ID_BATCH] for i in range(0, len(ids), CMC_ID_BATCH)]
+            stale = set()
+            for data, invalid in await asyncio.gather(*(_fetch_quotes_by_id(client, chunk) for chunk in chunks)):
+                stale |= invalid
+                for cmc_id, coin_data in data.items():
+                    result[id_to_local[int(cmc_id)]] = _parse_coin_data(coin_data)
+
+            # Delisted or merged coins: forget the stored id and look them up again.
+            stale_coins = [{**c, "cmc_id": None} for c in coins if c.get("cmc_id") in stale]
+            ids_update = {c["symbol"]: None for c in stale_coins}
+            if stale_coins:
+                logger.warning("CMC rejected stored ids for %s", ", ".join(ids_update))
+            unresolved += stale_coins
+            if unresolved:
+                resolved = await _resolve_quotes(client, unresolved, result)
+                ids_update.update(resolved)
+                if resolved:
+                    logger.info("Resolved CMC ids: %s", resolved)
+            if ids_update:
+                from db import set_coin_cmc_ids
+
+                await set_coin_cmc_ids(ids_update)
 
     except Exception as e:
         logger.error("CMC API request failed: %s", e)
         return {"error": str(e)}
 
+    await _remember_quotes(result)
+
     for c in coins:
         sym = c["symbol"]
         if sym not in result:
@@ -68,6 +87,211 @@ async def get_crypto_quotes(coins: list[dict]) -> dict:
     return result
 
 
+async def _fetch_quotes_by_id(client: httpx.AsyncClient, ids: list[int]) -> tuple[dict, set[int]]:
+    # CMC rejects the whole batch for one unknown id, naming it in the error: drop
+    # the named ids and retry, returning them so the caller can re-resolve those coins.
+    invalid = set()
+    while ids:
+        resp = await client.get(
+            f"{CMC_BASE}/v2/cryptocurrency/quotes/latest",
+            params={"id": ",".join(str(i) for i in ids), "convert": "USD"},
+        )
+        data = jsoncodec.loads(resp.content)
+        if data.get("status", {}).get("error_code", 0) == 0:
+            return data.get("data", {}), invalid
+        message = data.get("status", {}).get("error_message") or ""
+        bad = _invalid_ids(message) & set(ids)
+        if not bad:
+            logger.error("CMC quotes by id failed: %s", message)
+            break
+        invalid |= bad
+        ids = [i for i in ids if i not in bad]
+    return {}, invalid
+
+
+def _invalid_ids(message: str) -> set[int]:
+    # e.g. 'Invalid value for "id": "99999"' or 'Invalid values for "id": "1,2"'
+    match = CMC_INVALID_ID_RE.search(message)
+    if not match:
+        return set()
+    return {int(i) for i in match.group(1).split(",") if i.strip().isdigit()}
+
+
+def _pick_candidate(entries):
+    if not isinstance(entries, list):
+        return entries
+    return min(entries, key=lambda e: (e.get("cmc_rank") is None, e.get("cmc_rank") or 0))
+
+
+async def _resolve_quotes(client: httpx.AsyncClient, coins: list[dict], result: dict) -> dict[str, int]:
+    # Slow path for coins without a stored cmc_id: look them up by slug or symbol once,
+    # then the caller persists the ids so later calls go through the id batch.
+    slugs = [c["cmc_slug"] for c in coins if c.get("cmc_slug")]
+    symbols = [c["symbol"] for c in coins if not c.get("cmc_slug")]
+    slug_to_local = {c["cmc_slug"]: c["symbol"] for c in coins if c.get("cmc_slug")}
+    resolved = {}
+
+    if slugs:
+        resp = await client.get(
+            f"{CMC_BASE}/v2/cryptocurrency/quotes/latest",
+            params={"slug": ",".join(slugs), "convert": "USD"},
+        )
+        data = jsoncodec.loads(resp.content)
+        if data.get("status", {}).get("error_code", 0) == 0:
+            for _cmc_id, coin_data in data.get("data", {}).items():
+                coin_data = _pick_candidate(coin_data)
+                cmc_slug = coin_data.get("slug", "")
+                local_sym = slug_to_local.get(cmc_slug, coin_data.get("symbol", ""))
+                result[local_sym] = _parse_coin_data(coin_data)
+                if coin_data.get("id"):
+                    resolved[local_sym] = coin_data["id"]
+
+    if symbols:
+        resp = await client.get(
+            f"{CMC_BASE}/v2/cryptocurrency/quotes/latest",
+            params={"symbol": ",".join(symbols), "convert": "USD"},
+        )
+        data = jsoncodec.loads(resp.content)
+        if data.get("status", {}).get("error_code", 0) == 0:
+            for sym in symbols:
+                entries = data.get("data", {}).get(sym, [])
+                if entries:
+                    coin = _pick_candidate(entries)
+                    result[sym] = _parse_coin_data(coin)
+                    if coin.get("id"):
+                        resolved[sym] = coin["id"]
+                else:
+                    result[sym] = {"error": f"Токен {sym} не найден на CoinMarketCap"}
+
+    return resolved
+
+
+async def refresh_cmc_map() -> int:
+    if not CMC_API_KEY:
+        return 0
+    from db import replace_cmc_map
+
+    entries = []
+    headers = {"X-CMC_PRO_API_KEY": CMC_API_KEY, "Accept": "application/json"}
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, headers=headers) as client:
+        start = 1
+        while True:
+            resp = await client.get(
+                f"{CMC_BASE}/v1/cryptocurrency/map",
+                params={"listing_status": "active", "start": start, "limit": CMC_MAP_PAGE},
+            )
+            data = jsoncodec.loads(resp.content)
+            if data.get("status", {}).get("error_code", 0) != 0:
+                raise RuntimeError(data.get("status", {}).get("error_message", "CMC map request failed"))
+            page = data.get("data", [])
+            entries.extend(
+                (c["id"], c["symbol"].upper(), c["slug"], c["name"], c.get("rank")) for c in page
+            )
+            if len(page) < CMC_MAP_PAGE:
+                break
+            start += CMC_MAP_PAGE
+    await replace_cmc_map(entries)
+    logger.info("CMC map refreshed: %d coins", len(entries))
+    return len(entries)
+
+
+async def ensure_cmc_map(on_loading=None) -> bool:
+    # True once the map has been loaded. A failed load (or no CMC key) is remembered
+    # for CMC_MAP_RETRY_SECONDS so every /addcoins does not retry and re-announce it.
+    global _cmc_map_failed_at
+    from db import get_meta
+
+    if await get_meta("cmc_map_refreshed_at"):
+        return True
+    if not CMC_API_KEY or time.time() - _cmc_map_failed_at < CMC_MAP_RETRY_SECONDS:
+        return False
+    if on_loading is not None:
+        await on_loading()
+    try:
+        await refresh_cmc_map()
+        return True
+    except Exception as e:
+        logger.error("CMC map refresh failed: %s", e)
+        _cmc_map_failed_at = time.time()
+        return False
+
+
+async def _load_quote_cache():
+    global _quote_cache_loaded
+    if _quote_cache_loaded:
+        return
+    from db import load_latest_quotes
+
+    for sym, data, fetched_at in await load_latest_quotes():
+        _quote_cache.setdefault(sym, (jsoncodec.loads(data), fetched_at))
+    _quote_cache_loaded = True
+
+
+async def _remember_quotes(result: dict):
+    now = time.time()
+    fresh = {sym: data for sym, data in result.items() if isinstance(data, dict) and "error" not in data}
+    if not fresh:
+        return
+    for sym, data in fresh.items():
+        _quote_cache[sym] = (data, now)
+    try:
+        from db import save_latest_quotes
+
+        await save_latest_quotes(
+            [(sym, jsoncodec.dumps(data), now) for sym, data in fresh.items()]
+        )
+    except Exception as e:
+        logger.warning("Failed to persist latest quotes: %s", e)
+    try:
+        await indicator_engine.observe(fresh, now)
+    except Exception as e:
+        logger.warning("Failed to record price history: %s", e)
+
+
+def _start_quote_refresh(coins: list[dict]) -> asyncio.Task:
+    # Concurrent callers share a fetch only when they ask for the same coins, so a
+    # newly added coin is never answered from a refresh that does not include it.
+    key = tuple(sorted(c["symbol"] for c in coins))
+    task = _quote_refreshes.get(key)
+    if task is None or task.done():
+        task = _quote_refreshes[key] = asyncio.create_task(get_crypto_quotes(coins))
+
+        def _forget(done: asyncio.Task):
+            if _quote_refreshes.get(key) is done:
+                del _quote_refreshes[key]
+
+        task.add_done_callback(_forget)
+    return task
+
+
+async def get_cached_quotes(
+    coins: list[dict], max_age: int = QUOTE_MAX_AGE_SECONDS, wait: bool = True, refresh: bool = True
+) -> tuple[dict, float | None]:
+    # Serves /price and inline queries from memory. Only a coin that has never been
+    # fetched waits for CMC (unless wait=False); stale data is returned at once and
+    # refreshed in the background. refresh=False only reads the cache.
+    await _load_quote_cache()
+    now = time.time()
+    missing = [
+        c["symbol"] for c in coins
+        if c["symbol"] not in _quote_cache and now - _quote_misses.get(c["symbol"], 0) > max_age
+    ]
+    if missing and refresh:
+        task = _start_quote_refresh(coins)
+        if wait:
+            await task
+        for sym in missing:
+            if sym not in _quote_cache:
+                _quote_misses[sym] = now
+    cached = {c["symbol"]: _quote_cache[c["symbol"]] for c in coins if c["symbol"] in _quote_cache}
+    if not cached:
+        return {}, None
+    oldest = min(fetched_at for _, fetched_at in cached.values())
+    if refresh and now - oldest > max_age:
+        _start_quote_refresh(coins)
+    return {sym: data for sym, (data, _) in cached.items()}, oldest
+
+
 def _parse_coin_data(coin: dict) -> dict:
     quote = coin.get("quote", {}).get("USD", {})
     price = quote.get("price")
@@ -118,69 +342,141 @@ def _parse_coin_data(coin: dict) -> dict:
     }
 
 
-async def search_crypto_news(symbol: str, max_results: int = 5) -> list[dict]:
+async def _search_archived(symbol: str, kind: str, query: str, max_results: int) -> list[dict]:
+    # Fresh results are archived; when DDG is slow, failing or empty, the summary
+    # falls back to what was archived for this coin in the last NEWS_FALLBACK_HOURS.
+    import db
+
     results = []
     try:
-        results = await _search_ddg(f'"{symbol}" crypto token news', max_results)
+        results = await asyncio.wait_for(_search_ddg(query, max_results), NEWS_SEARCH_TIMEOUT)
     except Exception as e:
-        logger.warning("DDG news search failed: %s", e)
-    return results[:max_results]
+        logger.warning("DDG %s search for %s failed: %s", kind, symbol, str(e) or type(e).__name__)
+    if results:
+        try:
+            await db.archive_news(symbol, kind, results)
+        except Exception as e:
+            logger.warning("News archive write failed: %s", e)
+        return results[:max_results]
+    try:
+        archived = await db.recent_news(symbol, kind, time.time() - NEWS_FALLBACK_HOURS * 3600, max_results)
+    except Exception as e:
+        logger.warning("News archive read failed: %s", e)
+        return []
+    if archived:
+        logger.info("Using %d archived %s items for %s", len(archived), kind, symbol)
+    return archived
+
+
+async def search_crypto_news(symbol: str, max_results: int = 5) -> list[dict]:
+    return await _search_archived(symbol, "news", f'"{symbol}" crypto token news', max_results)
 
 
 async def search_twitter_mentions(symbol: str, max_results: int = 4) -> list[dict]:
-    results = []
-    try:
-        results = await _search_ddg(
-            f'"{symbol}" crypto site:x.com OR site:twitter.com', max_results
-        )
-    except Exception as e:
-        logger.warning("Twitter search failed: %s", e)
-    return results[:max_results]
+    return await _search_archived(
+        symbol, "twitter", f'"{symbol}" crypto site:x.com OR site:twitter.com', max_results
+    )
 
 
 async def search_whale_alerts(symbol: str) -> list[dict]:
-    results = []
-    try:
-        results = await _search_ddg(f'"{symbol}" whale alert large transaction', 3)
-    except Exception as e:
-        logger.warning("Whale alert search failed: %s", e)
-    return results
+    return await _search_archived(symbol, "whales", f'"{symbol}" whale alert large transaction', 3)
+
+
+DDG_LITE_URL = "https://lite.duckduckgo.com/lite/"
+DDG_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+
+class DdgLiteParser(HTMLParser):
+    # Incremental: feed() the page as it arrives and stop reading once `done`.
+    # A result is a result-link anchor plus the result-snippet cell that follows it;
+    # rows marked result-sponsored are ads and are skipped.
+
+    def __init__(self, max_results: int):
+        super().__init__(convert_charrefs=True)
+        self.max_results = max_results
+        self.results: list[dict] = []
+        self._current = None
+        self._field = None
+        self._parts: list[str] = []
+        self._sponsored = False
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) >= self.max_results
+
+    def _finish_result(self):
+        if self._current and self._current["title"] and not self.done:
+            self.results.append(self._current)
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._field:
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if tag == "tr":
+            self._sponsored = "result-sponsored" in classes
+        elif self._sponsored:
+            return
+        elif tag == "a" and "result-link" in classes:
+            self._finish_result()
+            self._current = {"title": "", "url": attrs.get("href", ""), "snippet": ""}
+            self._field, self._parts = "title", []
+        elif tag == "td" and "result-snippet" in classes and self._current:
+            self._field, self._parts = "snippet", []
+
+    def handle_endtag(self, tag):
+        if (self._field == "title" and tag == "a") or (self._field == "snippet" and tag == "td"):
+            self._current[self._field] = " ".join("".join(self._parts).split())
+            if self._field == "snippet":
+                self._finish_result()
+            self._field = None
+
+    def handle_data(self, data):
+        if self._field:
+            self._parts.append(data)
+
+    def finish(self) -> list[dict]:
+        self.close()
+        self._finish_result()
+        return self.results
 
 
 async def _search_ddg(query: str, max_results: int = 8) -> list[dict]:
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
-    async with httpx.AsyncClient(headers=headers, follow_redirects=True, timeout=15) as client:
-        resp = await client.post(
-            "https://lite.duckduckgo.com/lite/", data={"q": query}
-        )
-        text = resp.text
-        results = []
-        link_pattern = re.compile(
-            r"""<a\s+rel=["']nofollow["']\s+href=["']([^"']+)["']\s+class=["']result-link["'][^>]*>(.*?)</a>""",
-            re.DOTALL,
-        )
-        snippet_pattern = re.compile(
-            r"""<td\s+class=["']result-snippet["'][^>]*>(.*?)</td>""", re.DOTALL
-        )
-        links = link_pattern.findall(text)
-        snippets = snippet_pattern.findall(text)
-        for i, (href, title) in enumerate(links[:max_results]):
-            clean_title = unescape(re.sub(r"<.*?>", "", title)).strip()
-            clean_snippet = ""
-            if i < len(snippets):
-                clean_snippet = unescape(re.sub(r"<.*?>", "", snippets[i])).strip()
-            if clean_title:
-                results.append(
-                    {"title": clean_title, "url": href, "snippet": clean_snippet}
-                )
-        return results
-
-
-async def generate_ai_summary(crypto_data: dict, news_data: dict, twitter_data: dict, whale_data: dict = None) -> str:
+    parser = DdgLiteParser(max_results)
+    async with httpx.AsyncClient(headers=DDG_HEADERS, follow_redirects=True, timeout=15) as client:
+        async with client.stream("POST", DDG_LITE_URL, data={"q": query}) as resp:
+            async for chunk in resp.aiter_text():
+                parser.feed(chunk)
+                if parser.done:
+                    # Leaving the block closes the connection; the rest of the page is never read.
+                    break
+    return parser.finish()
+
+
+async def generate_ai_summary(
+    crypto_data: dict, news_data: dict, twitter_data: dict, whale_data: dict = None, indicators: dict = None
+) -> str:
+    text = await _ai_summary_text(crypto_data, news_data, twitter_data, whale_data, indicators)
+    if text is None:
+        return _format_raw_summary(crypto_data, news_data, twitter_data, indicators)
+    return text
+
+
+async def _ai_summary_text(
+    crypto_data: dict,
+    news_data: dict,
+    twitter_data: dict,
+    whale_data: dict = None,
+    indicators: dict = None,
+    changes: dict = None,
+) -> str | None:
+    # None when the LLM is not configured or did not answer, so callers can tell an
+    # AI summary from the raw fallback.
     if not OPENROUTER_API_KEY:
-        return _format_raw_summary(crypto_data, news_data, twitter_data)
+        return None
 
     system_prompt = (
         "Ты - криптоаналитик. Создай КРАТКУЮ сводку НА РУССКОМ.\n"
@@ -189,35 +485,45 @@ async def generate_ai_summary(crypto_data: dict, news_data: dict, twitter_data:
         "ВАЖНО: Пиши ТОЛЬКО о токенах OWB и RNBW (Rainbow). НЕ путай их с другими токенами (XRP, BTC и т.д.). "
         "Если новость не относится к OWB или RNBW - пропусти её.\n\n"
         "Структура:\n"
-        "1. ЦЕНЫ - цена, изменение 1ч/24ч/7д, объём, давление\n"
+        "1. ЦЕНЫ - цена, изменение 1ч/24ч/7д, объём, давление; если есть indicators - "
+        "кратко тренд относительно MA, RSI, волатильность и аномальный объём\n"
         "2. КРУПНЫЕ СДЕЛКИ - анализ по объёмам\n"
         "3. НОВОСТИ - кратко по 1-2 предложения на каждую\n"
         "4. ВЫВОД - 2-3 предложения\n\n"
         "Будь кратким. Формат: $1,234.56, +5.2%, -3.1%. Если данных нет - укажи."
     )
+    if changes:
+        system_prompt += (
+            "\n\nЕсть changes_since_previous: изменения с прошлой сводки (since_utc). "
+            "Котировки в данных - только по монетам, где цена заметно изменилась; "
+            "монеты из unchanged с тех пор почти не двигались. "
+            "Новости, твиты и сделки в данных - только новые с того момента. "
+            "Начни с короткого блока «Что изменилось с прошлой сводки» (цены, новые события)."
+        )
 
-    user_content = json.dumps(
+    # Compact on purpose: indentation only costs prompt tokens.
+    user_content = jsoncodec.dumps(
         {
             "crypto_data": crypto_data,
             "news": news_data,
             "twitter_mentions": twitter_data,
             "whale_alerts": whale_data or {},
+            "indicators": indicators or {},
+            "changes_since_previous": changes or {},
             "generated_at_utc": datetime.utcnow().isoformat(),
         },
-        indent=2,
-        ensure_ascii=False,
         default=str,
     )
 
     try:
-        async with httpx.AsyncClient(timeout=90) as client:
+        async with ai_gate.slot(PRIORITY_SUMMARY), httpx.AsyncClient(timeout=90) as client:
             resp = await client.post(
                 f"{OPENROUTER_BASE}/chat/completions",
                 headers={
                     "Authorization": f"Bearer {OPENROUTER_API_KEY}",
                     "Content-Type": "application/json",
                 },
-                json={
+                content=jsoncodec.dumps_bytes({
                     "model": AI_MODEL,
                     "messages": [
                         {"role": "system", "content": system_prompt},
@@ -225,22 +531,20 @@ async def generate_ai_summary(crypto_data: dict, news_data: dict, twitter_data:
                     ],
                     "max_tokens": 2000,
                     "temperature": 0.3,
-                },
+                }),
             )
-            data = resp.json()
+            data = jsoncodec.loads(resp.content)
             if "choices" in data and data["choices"]:
                 return data["choices"][0]["message"]["content"]
             elif "error" in data:
                 logger.error("OpenRouter error: %s", data["error"])
-                return _format_raw_summary(crypto_data, news_data, twitter_data)
-            else:
-                return _format_raw_summary(crypto_data, news_data, twitter_data)
+            return None
     except Exception as e:
         logger.error("AI summary generation failed: %s", e)
-        return _format_raw_summary(crypto_data, news_data, twitter_data)
+        return None
 
 
-async def ask_ai(question: str, context: str = "") -> str:
+async def ask_ai(question: str, context: str = "", on_queued=None, user_id: int = None) -> str:
     if not OPENROUTER_API_KEY:
         return "AI-агент не настроен. Установите OPENROUTER_API_KEY."
     system_prompt = (
@@ -251,47 +555,62 @@ async def ask_ai(question: str, context: str = "") -> str:
     )
     if context:
         system_prompt += f"\n\nДополнительный контекст:\n{context}"
+    history = conversations.messages(user_id) if user_id is not None else []
 
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
+        async with ai_gate.slot(PRIORITY_CHAT, on_queued), httpx.AsyncClient(timeout=60) as client:
             resp = await client.post(
                 f"{OPENROUTER_BASE}/chat/completions",
                 headers={
                     "Authorization": f"Bearer {OPENROUTER_API_KEY}",
                     "Content-Type": "application/json",
                 },
-                json={
+                content=jsoncodec.dumps_bytes({
                     "model": AI_MODEL,
                     "messages": [
                         {"role": "system", "content": system_prompt},
+                        *history,
                         {"role": "user", "content": question},
                     ],
                     "max_tokens": 1500,
                     "temperature": 0.5,
-                },
+                }),
             )
-            data = resp.json()
+            data = jsoncodec.loads(resp.content)
             if "choices" in data and data["choices"]:
-                return data["choices"][0]["message"]["content"]
+                answer = data["choices"][0]["message"]["content"]
+                if user_id is not None:
+                    conversations.record(user_id, question, answer)
+                return answer
             elif "error" in data:
                 err = data["error"]
                 if isinstance(err, dict):
                     return f"Ошибка AI: {err.get('message', str(err))}"
                 return f"Ошибка AI: {err}"
             return "Нет ответа от AI."
+    except QueueFull:
+        raise
     except Exception as e:
         logger.error("AI request failed: %s", e)
         return f"Ошибка запроса к AI: {e}"
 
 
-async def generate_full_summary() -> str:
+NO_COINS_TEXT = "<b>Нет отслеживаемых монет.</b>\nАдмин может добавить монеты через админ-панель."
+
+
+async def collect_summary_inputs() -> dict | None:
     from db import get_active_coins
 
     coins = await get_active_coins()
     if not coins:
-        return "<b>Нет отслеживаемых монет.</b>\nАдмин может добавить монеты через админ-панель."
+        return None
 
     crypto_data = await get_crypto_quotes(coins)
+    try:
+        indicators = await indicator_engine.snapshot(crypto_data)
+    except Exception as e:
+        logger.warning("Indicators unavailable: %s", e)
+        indicators = {}
 
     news_data = {}
     twitter_data = {}
@@ -302,12 +621,179 @@ async def generate_full_summary() -> str:
         twitter_data[sym] = await search_twitter_mentions(sym)
         whale_data[sym] = await search_whale_alerts(sym)
 
-    summary = await generate_ai_summary(crypto_data, news_data, twitter_data, whale_data)
-    timestamp = datetime.utcnow().strftime("%d.%m.%Y %H:%M UTC")
+    return {
+        "crypto_data": crypto_data,
+        "news": news_data,
+        "twitter": twitter_data,
+        "whales": whale_data,
+        "indicators": indicators,
+    }
+
+
+async def cached_summary_inputs() -> dict | None:
+    # Summary inputs without waiting for any upstream: quotes from the cache and
+    # news, tweets and whale alerts from the archive.
+    import db
+
+    try:
+        coins = await db.get_active_coins()
+    except Exception as e:
+        # Last resort: whatever this process has quotes for.
+        logger.warning("Active coins unavailable, using cached quotes only: %s", e)
+        coins = [{"symbol": sym} for sym in _quote_cache]
+    if not coins:
+        return None
+    try:
+        crypto_data, _ = await get_cached_quotes(coins, wait=False)
+    except Exception as e:
+        logger.warning("Quote cache unavailable: %s", e)
+        wanted = {c["symbol"] for c in coins}
+        crypto_data = {sym: data for sym, (data, _) in _quote_cache.items() if sym in wanted}
+    try:
+        indicators = await indicator_engine.snapshot(crypto_data)
+    except Exception as e:
+        logger.warning("Indicators unavailable: %s", e)
+        indicators = {}
+    since = time.time() - NEWS_FALLBACK_HOURS * 3600
+    archived = {"news": {}, "twitter": {}, "whales": {}}
+    for c in coins:
+        sym = c["symbol"]
+        crypto_data.setdefault(sym, {"error": "Нет свежих котировок"})
+        for kind, limit in (("news", 5), ("twitter", 4), ("whales", 3)):
+            try:
+                archived[kind][sym] = await db.recent_news(sym, kind, since, limit)
+            except Exception as e:
+                logger.warning("News archive read failed: %s", e)
+                archived[kind][sym] = []
+    return {"crypto_data": crypto_data, **archived, "indicators": indicators}
+
+
+def _significant(value, digits: int = FINGERPRINT_PRICE_DIGITS):
+    # Always a float, so 65000 and 65012.3 fingerprint the same.
+    if not isinstance(value, (int, float)) or value == 0:
+        return value
+    return float(round(value, digits - 1 - int(math.floor(math.log10(abs(value))))))
+
+
+def summary_digest(inputs: dict) -> dict:
+    # What a summary is about: prices rounded so noise does not count as news, 24h
+    # change to whole percent, and the set of source URLs.
+    prices = {}
+    for sym, data in sorted(inputs["crypto_data"].items()):
+        if isinstance(data, dict) and "error" not in data:
+            prices[sym] = {
+                "price": _significant(data.get("price")),
+                "pct_24h": round(data["percent_change_24h"]) if data.get("percent_change_24h") is not None else None,
+            }
+    urls = sorted({
+        item["url"]
+        for key in ("news", "twitter", "whales")
+        for items in inputs[key].values()
+        for item in items
+        if item.get("url")
+    })
+    return {"prices": prices, "urls": urls}
+
+
+def _fingerprint(digest: dict) -> str:
+    return hashlib.sha256(jsoncodec.dumps_bytes(digest)).hexdigest()
+
+
+def _changes_since(previous: dict, digest: dict, inputs: dict) -> tuple[dict, dict]:
+    # Returns the delta for the prompt and the inputs trimmed to what is new since
+    # the previous summary: full quotes only for coins whose rounded digest moved,
+    # and only items that summary did not cover.
+    seen = set(previous["digest"]["urls"])
+    trimmed = dict(inputs)
+    moved = {sym for sym, now in digest["prices"].items() if previous["digest"]["prices"].get(sym) != now}
+    moved |= {sym for sym in inputs["crypto_data"] if sym not in digest["prices"]}
+    trimmed["crypto_data"] = {sym: data for sym, data in inputs["crypto_data"].items() if sym in moved}
+    trimmed["indicators"] = {sym: v for sym, v in (inputs.get("indicators") or {}).items() if sym in moved}
+    for key in ("news", "twitter", "whales"):
+        trimmed[key] = {
+            sym: [item for item in items if item.get("url") not in seen]
+            for sym, items in inputs[key].items()
+        }
+    prices = {}
+    for sym, now in digest["prices"].items():
+        before = previous["digest"]["prices"].get(sym)
+        if sym in moved and before and before.get("price") and now.get("price"):
+            prices[sym] = {
+                "was": before["price"],
+                "now": now["price"],
+                "change_pct": round((now["price"] / before["price"] - 1) * 100, 2),
+            }
+    changes = {
+        "since_utc": datetime.utcfromtimestamp(previous["created_at"]).strftime("%Y-%m-%d %H:%M"),
+        "prices": prices,
+        "unchanged": sorted(set(inputs["crypto_data"]) - moved),
+        "new_items": sum(len(items) for key in ("news", "twitter", "whales") for items in trimmed[key].values()),
+    }
+    return changes, trimmed
+
+
+async def summarize_inputs(inputs: dict, baseline: bool = False) -> str:
+    # Only scheduled summaries (baseline=True) prompt with a delta and store the
+    # snapshot the next one is compared with. Ad-hoc summaries get the full prompt
+    # and reuse a scheduled text only when the inputs are identical, so they never
+    # move the baseline the broadcast audience saw.
+    import db
+
+    digest = summary_digest(inputs)
+    fingerprint = _fingerprint(digest)
+    previous = None
+    try:
+        previous = await db.latest_summary_snapshot()
+        if previous:
+            previous["digest"] = jsoncodec.loads(previous["digest"])
+    except Exception as e:
+        logger.warning("Summary snapshot unavailable: %s", e)
+    if previous and previous["fingerprint"] == fingerprint:
+        logger.info("Summary inputs unchanged since %s, reusing text", previous["created_at"])
+        return previous["text"]
+
+    changes, prompt_inputs = None, inputs
+    if baseline and previous:
+        changes, prompt_inputs = _changes_since(previous, digest, inputs)
+    text = await _ai_summary_text(
+        prompt_inputs["crypto_data"],
+        prompt_inputs["news"],
+        prompt_inputs["twitter"],
+        prompt_inputs["whales"],
+        prompt_inputs.get("indicators"),
+        changes,
+    )
+    if text is None:
+        return format_raw_inputs(inputs)
+    if not baseline:
+        return text
+    try:
+        await db.save_summary_snapshot(fingerprint, jsoncodec.dumps(digest), text)
+    except Exception as e:
+        logger.warning("Failed to store summary snapshot: %s", e)
+    return text
+
+
+def format_raw_inputs(inputs: dict) -> str:
+    return _format_raw_summary(
+        inputs["crypto_data"], inputs["news"], inputs["twitter"], inputs.get("indicators")
+    )
+
+
+def with_summary_header(summary: str, at: datetime = None) -> str:
+    timestamp = (at or datetime.utcnow()).strftime("%d.%m.%Y %H:%M UTC")
     header = f"<b>Крипто Сводка</b> | {timestamp}\n{'=' * 30}\n\n"
     return header + summary
 
 
+async def generate_full_summary() -> str:
+    inputs = await collect_summary_inputs()
+    if inputs is None:
+        return NO_COINS_TEXT
+    summary = await summarize_inputs(inputs)
+    return with_summary_header(summary)
+
+
 def _fmt_price(price):
     if price is None:
         return "N/A"
@@ -355,37 +841,69 @@ PRESSURE_RU = {
 }
 
 
-def _format_raw_summary(crypto_data: dict, news_data: dict, twitter_data: dict) -> str:
+def format_price_headline(sym: str, data: dict) -> str:
+    return f"{sym}: {_fmt_price(data.get('price'))} ({_fmt_pct(data.get('percent_change_24h'))} за 24ч)"
+
+
+def format_quote_line(sym: str, data: dict) -> str:
+    return (
+        f"{format_price_headline(sym, data)}, 7д: {_fmt_pct(data.get('percent_change_7d'))}, "
+        f"объём 24ч: {_fmt_vol(data.get('volume_24h'))}"
+    )
+
+
+def format_price_block(sym: str, data) -> str | None:
+    if isinstance(data, dict) and "error" in data:
+        return f"<b>{sym}</b>: {data['error']}"
+    if not isinstance(data, dict):
+        return None
+
+    name = data.get("name", sym)
+    pressure = PRESSURE_RU.get(data.get("pressure", "neutral"), "")
+
+    return (
+        f"<b>{name} ({sym})</b>\n"
+        f"Цена: {_fmt_price(data.get('price'))}\n"
+        f"1ч: {_fmt_pct(data.get('percent_change_1h'))} | "
+        f"24ч: {_fmt_pct(data.get('percent_change_24h'))} | "
+        f"7д: {_fmt_pct(data.get('percent_change_7d'))}\n"
+        f"30д: {_fmt_pct(data.get('percent_change_30d'))} | "
+        f"60д: {_fmt_pct(data.get('percent_change_60d'))} | "
+        f"90д: {_fmt_pct(data.get('percent_change_90d'))}\n"
+        f"Объём 24ч: {_fmt_vol(data.get('volume_24h'))}\n"
+        f"Изм. объёма: {_fmt_pct(data.get('volume_change_24h'))}\n"
+        f"Market Cap: {_fmt_mcap(data.get('market_cap'))}\n"
+        f"FDV: {_fmt_mcap(data.get('fully_diluted_market_cap'))}\n"
+        f"Давление: {pressure}\n"
+    )
+
+
+def format_indicators(values: dict) -> str:
+    items = []
+    if "ma_24h" in values:
+        items.append(f"MA 24ч: {_fmt_price(values['ma_24h'])}")
+    if "ma_7d" in values:
+        items.append(f"MA 7д: {_fmt_price(values['ma_7d'])} ({_fmt_pct(values['price_vs_ma_7d_pct'])})")
+    if "rsi_14h" in values:
+        items.append(f"RSI: {values['rsi_14h']:.0f}")
+    if "realized_vol_24h_pct" in values:
+        items.append(f"Волатильность 24ч: {values['realized_vol_24h_pct']:.1f}%")
+    if "volume_z_7d" in values:
+        items.append(f"Объём z: {values['volume_z_7d']:+.1f}")
+    return " | ".join(items)
+
+
+def _format_raw_summary(crypto_data: dict, news_data: dict, twitter_data: dict, indicators: dict = None) -> str:
     parts = []
     for sym, data in crypto_data.items():
-        if isinstance(data, dict) and "error" in data:
-            parts.append(f"<b>{sym}</b>: {data['error']}")
-            continue
-        if not isinstance(data, dict):
-            continue
-
-        name = data.get("name", sym)
-        pressure = PRESSURE_RU.get(data.get("pressure", "neutral"), "")
-
-        parts.append(
-            f"<b>{name} ({sym})</b>\n"
-            f"Цена: {_fmt_price(data.get('price'))}\n"
-            f"1ч: {_fmt_pct(data.get('percent_change_1h'))} | "
-            f"24ч: {_fmt_pct(data.get('percent_change_24h'))} | "
-            f"7д: {_fmt_pct(data.get('percent_change_7d'))}\n"
-            f"30д: {_fmt_pct(data.get('percent_change_30d'))} | "
-            f"60д: {_fmt_pct(data.get('percent_change_60d'))} | "
-            f"90д: {_fmt_pct(data.get('percent_change_90d'))}\n"
-            f"Объём 24ч: {_fmt_vol(data.get('volume_24h'))}\n"
-            f"Изм. объёма: {_fmt_pct(data.get('volume_change_24h'))}\n"
-            f"Market Cap: {_fmt_mcap(data.get('market_cap'))}\n"
-            f"FDV: {_fmt_mcap(data.get('fully_diluted_market_cap'))}\n"
-            f"Давление: {pressure}\n"
-        )
+        block = format_price_block(sym, data)
+        if block:
+            line = format_indicators((indicators or {}).get(sym, {}))
+            parts.append(f"{block.rstrip()}\n<i>{line}</i>\n" if line else block)
 
     if news_data:
         parts.append("<b>Новости:</b>")
-        for sym, articles in news_data.items():
+        for articles in news_data.values():
             for a in articles[:3]:
                 title = a.get("title", "")
                 url = a.get("url", "")
@@ -393,7 +911,7 @@ def _format_raw_summary(crypto_data: dict, news_data: dict, twitter_data: dict)
 
     if twitter_data:
         parts.append("\n<b>Twitter:</b>")
-        for sym, tweets in twitter_data.items():
+        for tweets in twitter_data.values():
             for t in tweets[:3]:
                 title = t.get("title", "")
                 url = t.get("url", "")
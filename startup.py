@@ -0,0 +1,26 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+
+    def total_ms(self) -> float:
+        return (self._last - self.started) * 1000
+
+    def report(self):
+        phases = " ".join(f"{name}={ms:.0f}ms" for name, ms in self.phases)
+        logger.info("Startup timing: %s total=%.0fms", phases, self.total_ms())
+
+
+startup_timer = StartupTimer()
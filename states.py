@@ -0,0 +1,47 @@
+import logging
+import time
+
+import db
+import jsoncodec
+from config import STATE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 300
+
+
+class StateStore:
+    # SQLite is the only copy (survives restarts, shared between processes), so a
+    # state cleared or overwritten by another worker is seen on the next read.
+
+    def __init__(self, ttl: int = STATE_TTL_SECONDS):
+        self.ttl = ttl
+        self._next_sweep = time.time() + SWEEP_INTERVAL
+
+    async def get(self, telegram_id: int) -> dict | None:
+        now = time.time()
+        await self._maybe_sweep(now)
+        row = await db.get_user_state(telegram_id, now)
+        if row is None:
+            return None
+        return jsoncodec.loads(row[0])
+
+    async def set(self, telegram_id: int, data: dict):
+        await db.set_user_state(telegram_id, jsoncodec.dumps(data), time.time() + self.ttl)
+
+    async def delete(self, telegram_id: int):
+        await db.delete_user_state(telegram_id)
+
+    async def _maybe_sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        try:
+            purged = await db.purge_expired_user_states(now)
+            if purged:
+                logger.info("Purged %d expired conversation states", purged)
+        except Exception as e:
+            logger.warning("State sweep failed: %s", e)
+
+
+user_states = StateStore()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import db
+import dedup
+from dedup import UpdateDeduplicator
+
+
+def _stored(monkeypatch, watermark, at):
+    meta = {dedup.WATERMARK_KEY: str(watermark), dedup.WATERMARK_AT_KEY: repr(at)}
+
+    async def get_meta(key, default=None):
+        return meta.get(key, default)
+
+    monkeypatch.setattr(db, "get_meta", get_meta)
+
+
+def test_drops_redelivered_updates():
+    d = UpdateDeduplicator()
+    assert d.is_new(100)
+    assert d.is_new(101)
+    assert not d.is_new(101)
+    assert not d.is_new(100)
+    assert d.dropped == 2
+
+
+def test_ids_restart_lower_after_restart(monkeypatch):
+    _stored(monkeypatch, 900_000, time.time() - 60)
+    d = UpdateDeduplicator()
+    asyncio.run(d.load())
+    # A redelivery of something just handled is still a duplicate.
+    assert not d.is_new(900_000)
+    d = UpdateDeduplicator()
+    asyncio.run(d.load())
+    # The sequence restarted far below the stored watermark.
+    assert d.is_new(1234)
+    assert d.is_new(1235)
+    assert not d.is_new(1235)
+
+
+def test_stale_watermark_is_ignored(monkeypatch):
+    _stored(monkeypatch, 900_000, time.time() - 8 * 24 * 3600)
+    d = UpdateDeduplicator()
+    asyncio.run(d.load())
+    assert d.watermark is None
+    assert d.is_new(899_990)
+
+
+def test_ids_restart_lower_while_running():
+    d = UpdateDeduplicator()
+    now = time.time()
+    assert d.is_new(50_000, now)
+    assert not d.is_new(49_000, now + 60)
+    assert d.is_new(49_000, now + 8 * 24 * 3600)
+    assert d.is_new(49_001, now + 8 * 24 * 3600)
+
+
+def test_flush_rewinds_stored_watermark(monkeypatch):
+    writes = {}
+
+    async def set_meta(key, value):
+        writes[key] = value
+
+    async def raise_meta_int(key, value):
+        writes[key] = str(max(int(writes.get(key, 0)), value))
+
+    monkeypatch.setattr(db, "set_meta", set_meta)
+    monkeypatch.setattr(db, "raise_meta_int", raise_meta_int)
+    d = UpdateDeduplicator()
+    now = time.time()
+    d.is_new(50_000, now)
+    asyncio.run(d.flush())
+    assert writes[dedup.WATERMARK_KEY] == "50000"
+    d.is_new(10, now + 8 * 24 * 3600)
+    asyncio.run(d.flush())
+    assert writes[dedup.WATERMARK_KEY] == "10"
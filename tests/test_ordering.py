@@ -0,0 +1,63 @@
+import asyncio
+
+from telegram import Update
+
+from ordering import ChatOrderedProcessor
+
+
+def _update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "x",
+            },
+        },
+        None,
+    )
+
+
+def test_slow_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = ChatOrderedProcessor(8)
+        release = asyncio.Event()
+        done = []
+
+        async def slow():
+            await release.wait()
+            done.append("slow")
+
+        async def fast(label):
+            done.append(label)
+
+        slow_task = asyncio.create_task(processor.process_update(_update(1, 100), slow()))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(_update(2, 200), fast("other chat")), 1)
+        assert done == ["other chat"]
+        release.set()
+        await slow_task
+        assert done == ["other chat", "slow"]
+
+    asyncio.run(scenario())
+
+
+def test_same_chat_keeps_arrival_order():
+    async def scenario():
+        processor = ChatOrderedProcessor(8)
+        done = []
+
+        async def step(label, delay):
+            await asyncio.sleep(delay)
+            done.append(label)
+
+        await asyncio.gather(*(
+            processor.process_update(_update(i, 100), step(i, delay))
+            for i, delay in enumerate((0.05, 0.0, 0.02))
+        ))
+        assert done == [0, 1, 2]
+        assert not processor._chats
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+import asyncio
+
+import httpx
+
+import db
+import services
+
+
+def _coin(cmc_id: int, symbol: str, slug: str) -> dict:
+    return {"id": cmc_id, "symbol": symbol, "slug": slug, "quote": {"USD": {"price": 1.0}}}
+
+
+def test_invalid_stored_id_is_dropped_and_resolved_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(services, "CMC_API_KEY", "key")
+    monkeypatch.setattr(services, "_remember_quotes", lambda result: asyncio.sleep(0))
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        params = dict(request.url.params)
+        requests.append(params)
+        if "id" in params:
+            ids = params["id"].split(",")
+            if "2" in ids:
+                status = {"error_code": 400, "error_message": 'Invalid value for "id": "2"'}
+                return httpx.Response(200, json={"status": status})
+            return httpx.Response(200, json={"status": {"error_code": 0}, "data": {"1": _coin(1, "BTC", "bitcoin")}})
+        return httpx.Response(200, json={"status": {"error_code": 0}, "data": {"20": _coin(20, "NEW", "new-coin")}})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        services.httpx, "AsyncClient", lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw)
+    )
+
+    async def scenario():
+        await db.init_db()
+        await db.add_coin("BTC", "Bitcoin", "bitcoin")
+        await db.add_coin("NEW", "New", "new-coin")
+        await db.set_coin_cmc_ids({"BTC": 1, "NEW": 2})
+        coins = [c for c in await db.get_active_coins() if c["symbol"] in ("BTC", "NEW")]
+        result = await services.get_crypto_quotes(coins)
+        return result, {c["symbol"]: c["cmc_id"] for c in await db.get_active_coins() if c["symbol"] in result}
+
+    result, ids = asyncio.run(scenario())
+    assert "error" not in result["BTC"] and "error" not in result["NEW"]
+    assert ids == {"BTC": 1, "NEW": 20}
+    assert [r.get("id") or r.get("slug") for r in requests] == ["1,2", "1", "new-coin"]
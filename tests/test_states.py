@@ -0,0 +1,37 @@
+import asyncio
+import multiprocessing
+
+import db
+from states import StateStore
+
+
+def _in_other_process(path: str, action: str):
+    db.DB_PATH = path
+    store = StateStore()
+    if action == "delete":
+        asyncio.run(store.delete(42))
+    else:
+        asyncio.run(store.set(42, {"state": action}))
+
+
+def _run_elsewhere(path: str, action: str):
+    proc = multiprocessing.get_context("spawn").Process(target=_in_other_process, args=(path, action))
+    proc.start()
+    proc.join(30)
+    assert proc.exitcode == 0
+
+
+def test_sees_changes_from_another_process(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    asyncio.run(db.init_db())
+    store = StateStore()
+
+    asyncio.run(store.set(42, {"state": "adding_coin_symbol"}))
+    assert asyncio.run(store.get(42)) == {"state": "adding_coin_symbol"}
+
+    _run_elsewhere(path, "bulk_adding_coins")
+    assert asyncio.run(store.get(42)) == {"state": "bulk_adding_coins"}
+
+    _run_elsewhere(path, "delete")
+    assert asyncio.run(store.get(42)) is None
@@ -0,0 +1,187 @@
+import re
+from functools import lru_cache
+from html import escape, unescape
+from html.parser import HTMLParser
+
+MAX_MESSAGE_LEN = 4000
+
+# Tags Telegram accepts with parse_mode=HTML.
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "code", "pre", "a", "tg-spoiler", "blockquote",
+}
+BLOCK_TAGS = {"p", "div", "br", "li", "ul", "ol", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+SKIP_TAGS = {"script", "style"}
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPLIT_RE = re.compile(r"[^\n]*\n|[^\n]+")
+
+
+class _Tokenizer(HTMLParser):
+    # Produces a flat token list from arbitrary (often LLM-written) HTML: text is kept
+    # raw, unsupported tags are dropped or turned into line breaks, and every closing
+    # token matches an opening one.
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens: list[tuple[str, str, str]] = []
+        self.stack: list[str] = []
+        self._skip = 0
+
+    def _open(self, tag: str, markup: str):
+        self.tokens.append(("open", tag, markup))
+        self.stack.append(tag)
+
+    def _close(self, tag: str):
+        while self.stack:
+            top = self.stack.pop()
+            self.tokens.append(("close", top, f"</{top}>"))
+            if top == tag:
+                break
+
+    def _newline(self):
+        for kind, _, markup in reversed(self.tokens):
+            if kind == "text":
+                if not markup.endswith("\n"):
+                    self.tokens.append(("text", "", "\n"))
+                return
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "strong":
+            tag = "b"
+        elif tag == "em":
+            tag = "i"
+        if tag == "span" and ("class", "tg-spoiler") in attrs:
+            tag = "tg-spoiler"
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self._open("a", f'<a href="{escape(href, quote=True)}">')
+        elif tag in ALLOWED_TAGS:
+            self._open(tag, f"<{tag}>")
+        elif tag in HEADING_TAGS:
+            self._newline()
+            self._open("b", "<b>")
+        elif tag == "li":
+            self._newline()
+            self.tokens.append(("text", "", "• "))
+        elif tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+            return
+        if tag == "strong":
+            tag = "b"
+        elif tag == "em":
+            tag = "i"
+        elif tag in HEADING_TAGS:
+            tag = "b"
+        elif tag == "span" and "tg-spoiler" in self.stack:
+            tag = "tg-spoiler"
+        if tag in self.stack:
+            self._close(tag)
+        if tag in BLOCK_TAGS or tag in HEADING_TAGS:
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br":
+            self.tokens.append(("text", "", "\n"))
+
+    def handle_data(self, data):
+        if data and not self._skip:
+            self.tokens.append(("text", "", data))
+
+    def finish(self) -> list[tuple[str, str, str]]:
+        self.close()
+        while self.stack:
+            self._close(self.stack[-1])
+        return self.tokens
+
+
+def _tokens(text: str) -> list[tuple[str, str, str]]:
+    parser = _Tokenizer()
+    parser.feed(text)
+    return parser.finish()
+
+
+def _pieces(raw: str, limit: int):
+    # Lines first; a line that cannot fit is cut on spaces, then hard. Cuts happen
+    # on raw text so an entity like &amp; is never split.
+    for line in _SPLIT_RE.findall(raw):
+        escaped = escape(line, quote=False)
+        if len(escaped) <= limit:
+            yield escaped
+            continue
+        rest = line
+        while rest:
+            n = size = 0
+            while n < len(rest):
+                width = len(escape(rest[n], quote=False))
+                if size + width > limit:
+                    break
+                size += width
+                n += 1
+            if n < len(rest):
+                space = rest.rfind(" ", 0, n)
+                if space > 0:
+                    n = space + 1
+            yield escape(rest[:n], quote=False)
+            rest = rest[n:]
+
+
+@lru_cache(maxsize=32)
+def render_chunks(text: str, max_len: int = MAX_MESSAGE_LEN) -> tuple[str, ...]:
+    """Sanitize Telegram HTML and split it into messages of at most max_len.
+
+    Breaks prefer line ends; tags open at a break are closed at the end of the
+    chunk and reopened at the start of the next one. Cached, so a summary sent to
+    many recipients is rendered once.
+    """
+    chunks: list[str] = []
+    stack: list[tuple[str, str]] = []
+    cur: list[str] = []
+    cur_len = 0
+    closing_len = 0
+    has_text = False
+
+    def flush():
+        nonlocal cur, cur_len, has_text
+        if has_text:
+            chunks.append("".join(cur) + "".join(f"</{tag}>" for tag, _ in reversed(stack)))
+        cur = [markup for _, markup in stack]
+        cur_len = sum(len(markup) for markup in cur)
+        has_text = False
+
+    for kind, tag, markup in _tokens(text):
+        if kind == "open":
+            if cur_len + len(markup) + closing_len + len(tag) + 3 > max_len:
+                flush()
+            stack.append((tag, markup))
+            closing_len += len(tag) + 3
+            cur.append(markup)
+            cur_len += len(markup)
+        elif kind == "close":
+            stack.pop()
+            closing_len -= len(tag) + 3
+            cur.append(markup)
+            cur_len += len(markup)
+        else:
+            limit = max(1, max_len - closing_len - sum(len(m) for _, m in stack))
+            for piece in _pieces(markup, limit):
+                if cur_len + len(piece) + closing_len > max_len:
+                    flush()
+                if not has_text and not piece.strip():
+                    continue
+                cur.append(piece if has_text else piece.lstrip("\n"))
+                cur_len += len(cur[-1])
+                has_text = True
+    flush()
+    return tuple(chunk.strip("\n") for chunk in chunks)
+
+
+def strip_tags(chunk: str) -> str:
+    return unescape(_TAG_RE.sub("", chunk))
@@ -0,0 +1,96 @@
+"""Compare the streaming DuckDuckGo lite parser with the old regex extraction.
+
+Usage (from the repository root):
+
+    python -m tools.bench_ddg [--repeat 200] [--chunk 4096]
+
+Pages in tools/fixtures/ddg follow the lite.duckduckgo.com result layout. The
+regex baseline is the previous implementation with its patterns compiled once;
+it always scans the whole page. The parser is fed the page in network-sized
+chunks and stops as soon as it has max_results results, as _search_ddg does.
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+from html import unescape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tools", "fixtures", "ddg")
+
+LINK_RE = re.compile(
+    r"""<a\s+rel=["']nofollow["']\s+href=["']([^"']+)["']\s+class=["']result-link["'][^>]*>(.*?)</a>""",
+    re.DOTALL,
+)
+SNIPPET_RE = re.compile(r"""<td\s+class=["']result-snippet["'][^>]*>(.*?)</td>""", re.DOTALL)
+TAG_RE = re.compile(r"<.*?>")
+
+
+def parse_regex(text: str, max_results: int) -> list[dict]:
+    links = LINK_RE.findall(text)
+    snippets = SNIPPET_RE.findall(text)
+    results = []
+    for i, (href, title) in enumerate(links[:max_results]):
+        clean_title = unescape(TAG_RE.sub("", title)).strip()
+        clean_snippet = unescape(TAG_RE.sub("", snippets[i])).strip() if i < len(snippets) else ""
+        if clean_title:
+            results.append({"title": clean_title, "url": href, "snippet": clean_snippet})
+    return results
+
+
+def parse_streaming(text: str, max_results: int, chunk: int) -> list[dict]:
+    from services import DdgLiteParser
+
+    parser = DdgLiteParser(max_results)
+    for start in range(0, len(text), chunk):
+        parser.feed(text[start:start + chunk])
+        if parser.done:
+            break
+    return parser.finish()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=4096)
+    args = parser.parse_args()
+    sys.path.insert(0, ROOT)
+
+    print(f"{'page':<20} {'bytes':>7} {'max':>4} {'regex':>9} {'stream':>9} {'read':>6}  results")
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            text = f.read()
+        for max_results in (3, 5, 8):
+            old = parse_regex(text, max_results)
+            new = parse_streaming(text, max_results, args.chunk)
+            # The regex also returns sponsored links; compare the organic ones.
+            organic = [r for r in parse_regex(text, 1000) if "y.js?ad_domain" not in r["url"]][:max_results]
+            same = [(r["title"], r["url"]) for r in organic] == [(r["title"], r["url"]) for r in new]
+            regex_us = timeit.timeit(lambda: parse_regex(text, max_results), number=args.repeat) / args.repeat * 1e6
+            stream_us = timeit.timeit(
+                lambda: parse_streaming(text, max_results, args.chunk), number=args.repeat
+            ) / args.repeat * 1e6
+            consumed = _consumed(text, max_results, args.chunk)
+            print(
+                f"{name:<20} {len(text):>7} {max_results:>4} {regex_us:>7.0f}us {stream_us:>7.0f}us "
+                f"{consumed:>5.0%}  {len(new)} ({'match' if same else 'DIFFER'}, regex had {len(old)})"
+            )
+    return 0
+
+
+def _consumed(text: str, max_results: int, chunk: int) -> float:
+    from services import DdgLiteParser
+
+    parser = DdgLiteParser(max_results)
+    read = 0
+    for start in range(0, len(text), chunk):
+        parser.feed(text[start:start + chunk])
+        read = min(len(text), start + chunk)
+        if parser.done:
+            break
+    return read / len(text) if text else 1.0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Compare the JSON codec against the stdlib on the payloads the bot handles.
+
+Usage (from the repository root):
+
+    python -m tools.bench_json [--repeat 2000]
+
+Fixtures in tools/fixtures/json are sample payloads in the shapes the bot sees:
+webhook updates, Bot API responses, CoinMarketCap quotes, OpenRouter replies
+and the summary prompt payload. Each is decoded from compact bytes and encoded
+back, once with the stdlib as the code used to, once with jsoncodec (orjson if
+installed).
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tools", "fixtures", "json")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import jsoncodec
+
+    print(f"codec backend: {jsoncodec.BACKEND}")
+    print(f"{'payload':<28} {'bytes':>7} {'loads std':>10} {'loads codec':>12} {'dumps std':>10} {'dumps codec':>12}")
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+            obj = json.load(f)
+        raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+        timings = [
+            timeit.timeit(lambda: json.loads(raw), number=args.repeat),
+            timeit.timeit(lambda: jsoncodec.loads(raw), number=args.repeat),
+            timeit.timeit(lambda: json.dumps(obj, ensure_ascii=False).encode(), number=args.repeat),
+            timeit.timeit(lambda: jsoncodec.dumps_bytes(obj), number=args.repeat),
+        ]
+        per_call = [t / args.repeat * 1e6 for t in timings]
+        print(
+            f"{name:<28} {len(raw):>7} {per_call[0]:>8.1f}us {per_call[1]:>10.1f}us "
+            f"{per_call[2]:>8.1f}us {per_call[3]:>10.1f}us"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Run EXPLAIN QUERY PLAN over every SQL statement in db.py and flag full scans.
+
+Usage (from the repository root):
+
+    python -m tools.check_query_plans
+
+The statements are extracted from db.py's source, so new queries are checked
+automatically. Calls whose SQL cannot be resolved statically (f-strings over
+runtime values, executescript) are listed as well. Exits with status 1 when a
+scan is found that is not listed in ALLOWED_SCANS, or an unchecked call that is
+not listed in ALLOWED_UNCHECKED.
+"""
+import ast
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_SOURCE = os.path.join(ROOT, "db.py")
+QUERY_KINDS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# (function, table) -> reason the scan is acceptable.
+ALLOWED_SCANS = {
+    ("get_analytics", "users"): "COUNT(*) over all users has to visit every row",
+    ("get_analytics", "broadcast_runs"): "ORDER BY id DESC LIMIT 1 stops after one row",
+    ("get_users_page", "users"): "first page walks idx_users_created and stops at LIMIT",
+    ("load_latest_quotes", "latest_quotes"): "loads the whole cache, one row per tracked coin",
+    ("latest_summary_snapshot", "summary_snapshots"): "walks the rowid backwards and stops at LIMIT 1",
+    ("add_coins_bulk", "coins"): "coins holds only the handful of tracked coins; runs on an admin command",
+}
+
+# (function, method) -> why the statement does not need a plan check.
+ALLOWED_UNCHECKED = {
+    ("_migrate_base_schema", "executescript"): "DDL only, runs once per database",
+    ("_migrate_broadcast_runs", "executescript"): "DDL only, runs once per database",
+    ("_migrate_workload_indexes", "executescript"): "DDL only, runs once per database",
+    ("_migrate_cmc_map", "executescript"): "DDL only, runs once per database",
+    ("_migrate_news_archive", "executescript"): "DDL only, runs once per database",
+    ("_add_column", "execute"): "PRAGMA table_info / ALTER TABLE in migrations",
+    ("incremental_vacuum", "executescript"): "PRAGMA incremental_vacuum, no table access",
+    ("iter_export_rows", "execute"): "full export of an EXPORT_COLUMNS table in rowid order; scans by design",
+}
+
+
+class _QueryCollector(ast.NodeVisitor):
+    def __init__(self, module_constants: dict):
+        self.module_constants = module_constants
+        self.queries: list[tuple[str, int, str]] = []
+        self.unchecked: list[tuple[str, int, str]] = []
+        self._function = None
+        self._locals: dict[str, str] = {}
+
+    def visit_AsyncFunctionDef(self, node):
+        self._function, self._locals = node.name, {}
+        self.generic_visit(node)
+        self._function = None
+
+    visit_FunctionDef = visit_AsyncFunctionDef
+
+    def visit_Assign(self, node):
+        if self._function and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            value = self._resolve(node.value)
+            if value is not None:
+                self._locals[node.targets[0].id] = value
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        func = node.func
+        if (
+            self._function
+            and isinstance(func, ast.Attribute)
+            and func.attr in ("execute", "executemany", "executescript")
+            and node.args
+        ):
+            sql = self._resolve(node.args[0])
+            if sql is None or func.attr == "executescript":
+                self.unchecked.append((self._function, node.lineno, func.attr))
+            elif sql.lstrip().upper().startswith(QUERY_KINDS):
+                self.queries.append((self._function, node.lineno, sql))
+        self.generic_visit(node)
+
+    def _resolve(self, node) -> str | None:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self._locals.get(node.id, self.module_constants.get(node.id))
+        if isinstance(node, ast.JoinedStr):
+            parts = []
+            for value in node.values:
+                if isinstance(value, ast.FormattedValue):
+                    value = value.value
+                resolved = self._resolve(value)
+                if resolved is None:
+                    return None
+                parts.append(resolved)
+            return "".join(parts)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left, right = self._resolve(node.left), self._resolve(node.right)
+            return left + right if left is not None and right is not None else None
+        return None
+
+
+def collect_queries() -> tuple[list[tuple[str, int, str]], list[tuple[str, int, str]]]:
+    with open(DB_SOURCE, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    constants = {}
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, str)
+        ):
+            constants[node.targets[0].id] = node.value.value
+    collector = _QueryCollector(constants)
+    collector.visit(tree)
+    return collector.queries, collector.unchecked
+
+
+async def _init_schema(path: str):
+    os.environ["DB_PATH"] = path
+    sys.path.insert(0, ROOT)
+    import db
+
+    db.DB_PATH = path
+    await db.init_db()
+
+
+def check(path: str) -> int:
+    queries, unchecked = collect_queries()
+    problems = 0
+    for function, lineno, method in unchecked:
+        reason = ALLOWED_UNCHECKED.get((function, method))
+        if reason:
+            print(f"skip  db.py:{lineno} {function}: {method} ({reason})")
+        else:
+            print(f"UNCHECKED db.py:{lineno} {function}: {method} with SQL that cannot be resolved statically")
+            problems += 1
+    conn = sqlite3.connect(path)
+    for function, lineno, sql in queries:
+        params = (None,) * sql.count("?")
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error as e:
+            print(f"ERROR db.py:{lineno} {function}: {e}\n    {sql}")
+            problems += 1
+            continue
+        for _, _, _, detail in plan:
+            if not detail.startswith("SCAN "):
+                continue
+            table = detail.split()[1]
+            reason = ALLOWED_SCANS.get((function, table))
+            if reason:
+                print(f"ok    db.py:{lineno} {function}: {detail} ({reason})")
+            else:
+                print(f"SCAN  db.py:{lineno} {function}: {detail}\n    {sql}")
+                problems += 1
+    conn.close()
+    return problems
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "plan.db")
+        asyncio.run(_init_schema(path))
+        problems = check(path)
+    print(f"{problems} unindexed full scan(s) or unchecked statement(s)" if problems else "No unindexed full scans")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
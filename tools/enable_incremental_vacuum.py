@@ -0,0 +1,38 @@
+"""Switch an existing database to incremental auto_vacuum.
+
+Usage (from the repository root, with DB_PATH pointing at the database):
+
+    python -m tools.enable_incremental_vacuum
+
+New databases, and existing ones up to db.VACUUM_AT_BOOT_MAX_BYTES, get
+incremental auto_vacuum on their own. A larger file needs one full VACUUM,
+which rewrites it under an exclusive lock, so the bot's writes wait until it
+finishes. Run it in a quiet moment; afterwards the nightly retention job frees
+pages in small incremental steps.
+"""
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def main_async() -> int:
+    sys.path.insert(0, ROOT)
+    import db
+
+    started = time.perf_counter()
+    if await db.enable_incremental_vacuum():
+        print(f"{db.DB_PATH}: switched to incremental auto_vacuum in {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"{db.DB_PATH}: incremental auto_vacuum already enabled")
+    return 0
+
+
+def main() -> int:
+    return asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
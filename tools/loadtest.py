@@ -0,0 +1,386 @@
+"""Drive the bot's real handlers with simulated users and report how it holds up.
+
+Usage (from the repository root):
+
+    python -m tools.loadtest --users 10,100,1000 --rounds 2 --concurrency 50
+
+Updates go through Application.process_update on an app built by
+main._build_app, against a throwaway database. The Bot API is replaced by a
+request stub and CoinMarketCap, OpenRouter and DuckDuckGo by an httpx mock
+transport, each answering after a configurable delay. Users send commands,
+the reply-keyboard buttons and a free-text question; seeded admins at the same
+time walk the admin panel through callback queries (summary run, analytics,
+user paging, the add/remove coin flow). For every user count the report shows
+throughput, update latency percentiles, time spent in SQLite writes/commits
+(lock contention shows up there) and memory growth, then latency per update
+type.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadBot", "username": "load_bot"}
+USER_BASE_ID = 10_000_000
+ADMIN_BASE_ID = 20_000_000
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class _Timings:
+    def __init__(self):
+        self.writes: list[float] = []
+        self.lock_errors = 0
+
+    def reset(self):
+        self.writes.clear()
+        self.lock_errors = 0
+
+
+def _instrument_sqlite(timings: _Timings):
+    # Write statements and commits are where SQLite serialises writers, so their
+    # wall time is the contention signal. Every "database is locked" counts, from
+    # whichever call raised it, reads included.
+    import aiosqlite
+    import sqlite3
+
+    original_execute = aiosqlite.Connection.execute
+    original_executemany = aiosqlite.Connection.executemany
+    original_executescript = aiosqlite.Connection.executescript
+    original_commit = aiosqlite.Connection.commit
+
+    async def counted(coro, timed: bool):
+        started = time.perf_counter()
+        try:
+            return await coro
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                timings.lock_errors += 1
+            raise
+        finally:
+            if timed:
+                timings.writes.append(time.perf_counter() - started)
+
+    def is_write(sql: str) -> bool:
+        return sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE")
+
+    async def execute(self, sql, parameters=None):
+        return await counted(original_execute(self, sql, parameters), is_write(sql))
+
+    async def executemany(self, sql, parameters):
+        return await counted(original_executemany(self, sql, parameters), is_write(sql))
+
+    async def executescript(self, sql_script):
+        return await counted(original_executescript(self, sql_script), True)
+
+    async def commit(self):
+        return await counted(original_commit(self), True)
+
+    aiosqlite.Connection.execute = execute
+    aiosqlite.Connection.executemany = executemany
+    aiosqlite.Connection.executescript = executescript
+    aiosqlite.Connection.commit = commit
+
+
+def _upstream_transport(latency: float):
+    import httpx
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        host, path = request.url.host, request.url.path
+        if host == "pro-api.coinmarketcap.com" and path.endswith("/quotes/latest"):
+            params = request.url.params
+            coin = lambda i, sym, slug: {
+                "id": i, "name": sym.title(), "symbol": sym, "slug": slug, "cmc_rank": 100,
+                "quote": {"USD": {
+                    "price": 1.2345, "volume_24h": 1e6, "volume_change_24h": 5.0,
+                    "percent_change_1h": 0.1, "percent_change_24h": 1.5, "percent_change_7d": -2.0,
+                    "market_cap": 1e8,
+                }},
+            }
+            if "id" in params:
+                data = {i: coin(int(i), f"C{i}", f"c{i}") for i in params["id"].split(",")}
+            elif "slug" in params:
+                data = {str(n): coin(n, s.upper()[:5], s) for n, s in enumerate(params["slug"].split(","), 1)}
+            else:
+                data = {s: [coin(n, s, s.lower())] for n, s in enumerate(params["symbol"].split(","), 1)}
+            return httpx.Response(200, json={"status": {"error_code": 0}, "data": data})
+        if host == "pro-api.coinmarketcap.com":
+            return httpx.Response(200, json={"status": {"error_code": 0}, "data": []})
+        if host == "openrouter.ai":
+            return httpx.Response(200, json={"choices": [{"message": {"content": "<b>Ответ</b>\nВсё спокойно."}}]})
+        if host == "lite.duckduckgo.com":
+            row = (
+                "<a rel=\"nofollow\" href=\"https://example.com/{n}\" class='result-link'>News {n}</a>"
+                "<td class='result-snippet'>Snippet {n}</td>"
+            )
+            return httpx.Response(200, text="".join(row.format(n=n) for n in range(10)))
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+def _patch_upstreams(latency: float):
+    import httpx
+
+    transport = _upstream_transport(latency)
+    original = httpx.AsyncClient
+
+    class StandInClient(original):
+        def __init__(self, *args, **kwargs):
+            kwargs["transport"] = transport
+            super().__init__(*args, **kwargs)
+
+    httpx.AsyncClient = StandInClient
+
+
+def _stub_request_class():
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        # Answers every Bot API call locally after `latency` seconds.
+        def __init__(self, latency: float):
+            self.latency = latency
+            self.calls = 0
+            self._message_ids = itertools.count(1)
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            await asyncio.sleep(self.latency)
+            self.calls += 1
+            endpoint = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data else {}
+            if endpoint == "getMe":
+                result = BOT_USER
+            elif endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+                chat_id = int(params.get("chat_id", 0))
+                result = {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": str(params.get("text", "")),
+                }
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return StubRequest
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"A{user_id}", "username": f"a{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "Админ-панель",
+            },
+        },
+    }
+
+
+# Steps are ("text", ...) messages, ("input", ...) replies inside a dialog or
+# ("callback", ...) button presses; "{n}" is the sender's index, so every admin
+# adds and removes its own coin.
+SCRIPT = (
+    ("text", "/start"),
+    ("text", "Сводка"),
+    ("text", "/price"),
+    ("text", "Монеты"),
+    ("text", "Что с OWB сегодня?"),
+    ("text", "Поддержать"),
+    ("text", "Помощь"),
+    ("text", "/help"),
+)
+ADMIN_SCRIPT = (
+    ("text", "Админ"),
+    ("callback", "admin_analytics"),
+    ("callback", "admin_users"),
+    ("callback", "users_page:older:{n}"),
+    ("callback", "admin_add_coin"),
+    ("input", "LT{n}"),
+    ("input", "Loadtest {n}"),
+    ("input", "-"),
+    ("callback", "admin_remove_coin"),
+    ("callback", "rm_coin_LT{n}"),
+    ("callback", "admin_run_summary"),
+)
+
+
+def _label(kind: str, template: str) -> str:
+    if kind == "callback":
+        return "callback " + template.split(":")[0].replace("LT{n}", "").rstrip("_")
+    if kind == "input":
+        return "dialog input"
+    return "message " + (template if len(template) <= 16 else "free text")
+
+
+async def _run(app, users: int, admins: int, rounds: int, concurrency: int, update_ids) -> dict:
+    from telegram import Update
+
+    latencies = []
+    by_type: dict[str, list[float]] = {}
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def on_error(update, context):
+        nonlocal errors
+        errors += 1
+
+    app.add_error_handler(on_error)
+
+    async def one(user_id: int, step: tuple[str, str], n: int):
+        nonlocal errors
+        kind, value = step
+        value = value.format(n=n)
+        build = _callback_update if kind == "callback" else _message_update
+        update = Update.de_json(build(next(update_ids), user_id, value), app.bot)
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await app.process_update(update)
+            except Exception:
+                errors += 1
+            spent = time.perf_counter() - started
+            latencies.append(spent)
+            by_type.setdefault(_label(*step), []).append(spent)
+
+    # Each user and each admin goes through its script in order; everyone runs
+    # interleaved, so admin writes compete with user traffic.
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for i in range(max(len(SCRIPT), len(ADMIN_SCRIPT))):
+            batch = []
+            if i < len(SCRIPT):
+                batch += [one(USER_BASE_ID + u, SCRIPT[i], u + 1) for u in range(users)]
+            if i < len(ADMIN_SCRIPT):
+                batch += [one(ADMIN_BASE_ID + a, ADMIN_SCRIPT[i], a + 1) for a in range(admins)]
+            await asyncio.gather(*batch)
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(latencies), "elapsed": elapsed, "latencies": latencies, "errors": errors, "by_type": by_type,
+    }
+
+
+async def _seed_admins(db, admins: int):
+    for a in range(admins):
+        await db.get_or_create_user(ADMIN_BASE_ID + a, f"a{ADMIN_BASE_ID + a}", "Admin")
+        await db.authenticate_user(ADMIN_BASE_ID + a)
+
+
+async def main_async(args) -> int:
+    sys.path.insert(0, ROOT)
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "bot.db")
+    for key in ("BOT_TOKEN", "CMC_API_KEY", "OPENROUTER_API_KEY"):
+        os.environ.setdefault(key, "123456:loadtest" if key == "BOT_TOKEN" else "loadtest")
+    os.environ.setdefault("AI_USER_RATE_PER_MIN", "600")
+    os.environ.setdefault("AI_USER_BURST", "100")
+    os.environ["ADMIN_IDS"] = ",".join(str(ADMIN_BASE_ID + a) for a in range(args.admins))
+
+    _patch_upstreams(args.upstream_latency / 1000)
+    timings = _Timings()
+    _instrument_sqlite(timings)
+
+    import db
+    import main
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    request = _stub_request_class()(args.bot_latency / 1000)
+    update_ids = itertools.count(1)
+    tracemalloc.start()
+
+    print(f"{'users':>6} {'updates':>8} {'upd/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'write p95':>9} {'write max':>9} {'locked':>6} {'mem +KiB':>9} {'errors':>6}")
+    per_type = []
+    for users in args.users:
+        db.DB_PATH = os.path.join(tmp, f"bot-{users}.db")
+        await db.init_db()
+        await _seed_admins(db, args.admins)
+        app = main._build_app(scheduled_jobs=False, request=request)
+        await app.initialize()
+        timings.reset()
+        before, _ = tracemalloc.get_traced_memory()
+        result = await _run(app, users, args.admins, args.rounds, args.concurrency, update_ids)
+        after, _ = tracemalloc.get_traced_memory()
+        await app.shutdown()
+        lat = [v * 1000 for v in result["latencies"]]
+        writes = [v * 1000 for v in timings.writes]
+        print(
+            f"{users:>6} {result['updates']:>8} {result['updates'] / result['elapsed']:>8.1f} "
+            f"{_percentile(lat, 50):>8.1f} {_percentile(lat, 95):>8.1f} {_percentile(lat, 99):>8.1f} "
+            f"{_percentile(writes, 95):>9.1f} {max(writes, default=0):>9.1f} {timings.lock_errors:>6} "
+            f"{(after - before) / 1024:>9.0f} {result['errors']:>6}"
+        )
+        per_type.append((users, result["by_type"]))
+    print(f"\n{'users':>6} {'update type':<28} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for users, by_type in per_type:
+        for label, values in sorted(by_type.items()):
+            values = [v * 1000 for v in values]
+            print(
+                f"{users:>6} {label:<28} {len(values):>6} {_percentile(values, 50):>8.1f} "
+                f"{_percentile(values, 95):>8.1f} {max(values):>8.1f}"
+            )
+    print(f"Bot API calls: {request.calls}, peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MiB")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=lambda v: [int(x) for x in v.split(",")], default=[10, 100])
+    parser.add_argument("--admins", type=int, default=3, help="seeded admins walking the admin panel")
+    parser.add_argument("--rounds", type=int, default=1, help="times each user repeats the script")
+    parser.add_argument("--concurrency", type=int, default=50, help="updates processed at once")
+    parser.add_argument("--bot-latency", type=float, default=20, help="Bot API delay, ms")
+    parser.add_argument("--upstream-latency", type=float, default=50, help="CMC/OpenRouter/DDG delay, ms")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging")
+    return asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
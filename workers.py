@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import itertools
+import multiprocessing
+import queue as queue_module
+import time
+
+logger = logging.getLogger(__name__)
+
+TRIGGER = "trigger"
+SCHEDULER_WORKER = 0
+MONITOR_INTERVAL = 5
+
+
+def shard_key(data: dict) -> int:
+    # Everything from one chat lands on the same worker, which handles its queue in
+    # order, so per-chat ordering and in-process state (rate limits, dialogs) hold.
+    for field in ("message", "edited_message", "channel_post", "my_chat_member", "chat_member"):
+        chat = (data.get(field) or {}).get("chat")
+        if chat:
+            return chat["id"]
+    callback = data.get("callback_query")
+    if callback:
+        chat = (callback.get("message") or {}).get("chat")
+        return chat["id"] if chat else callback["from"]["id"]
+    for field in ("inline_query", "chosen_inline_result"):
+        if data.get(field):
+            return data[field]["from"]["id"]
+    return data.get("update_id", 0)
+
+
+class WorkerPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue() for _ in range(size)]
+        self._replies = self._ctx.Queue()
+        self._trigger_ids = itertools.count(1)
+        self._processes = [None] * size
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=worker_main, args=(index, self._queues[index], self._replies), name=f"worker-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info("Worker %d started (pid %s)", index, process.pid)
+
+    def start(self):
+        for index in range(self.size):
+            self._spawn(index)
+
+    def dispatch(self, data: dict):
+        self._queues[shard_key(data) % self.size].put(data)
+
+    def trigger_summary(self, timeout: float) -> str:
+        # Runs on the scheduler worker, which holds or contends for leadership, and
+        # waits for its outcome. Replies to earlier triggers that timed out are skipped.
+        trigger_id = next(self._trigger_ids)
+        self._queues[SCHEDULER_WORKER].put((TRIGGER, trigger_id))
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                reply_id, outcome = self._replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue_module.Empty:
+                raise TimeoutError(f"no trigger outcome in {timeout}s") from None
+            if reply_id == trigger_id:
+                return outcome
+
+    def monitor(self):
+        # Queues outlive their worker, so updates routed to a crashed worker wait
+        # for its replacement instead of being lost.
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.error("Worker %d exited with code %s, restarting", index, process.exitcode)
+                    self._spawn(index)
+
+
+async def _serve(index: int, queue, replies):
+    import main
+    from dedup import update_dedup
+    from leader import leader
+    from telegram import Update
+
+    scheduler = index == SCHEDULER_WORKER
+    verify_task = None
+    app = main._build_app(scheduled_jobs=scheduler)
+    await app.initialize()
+    await update_dedup.load()
+    if scheduler:
+        webhook_url = f"https://{main.WEBHOOK_HOST}{main.WEBHOOK_PATH}"
+        await main._ensure_webhook(app, webhook_url)
+        verify_task = asyncio.create_task(main._verify_webhook(app, webhook_url))
+    await app.start()
+    logger.info("Worker %d ready%s", index, " (scheduled jobs)" if scheduler else "")
+
+    try:
+        while True:
+            item = await asyncio.to_thread(queue.get)
+            if item is None:
+                break
+            if isinstance(item, tuple) and item[0] == TRIGGER:
+                app.create_task(_trigger(app, replies, item[1]))
+                continue
+            try:
+                await app.update_queue.put(Update.de_json(item, app.bot))
+            except Exception as e:
+                logger.error("Worker %d could not parse update: %s", index, e)
+    finally:
+        if verify_task is not None:
+            verify_task.cancel()
+        await update_dedup.flush()
+        await leader.release()
+        await app.stop()
+        await app.shutdown()
+
+
+async def _trigger(app, replies, trigger_id: int):
+    import main
+
+    try:
+        outcome = await main._run_trigger_summary(app.bot)
+    except Exception as e:
+        logger.error("Trigger summary failed: %s", e)
+        outcome = "failed"
+    replies.put((trigger_id, outcome))
+
+
+def worker_main(index: int, queue, replies):
+    asyncio.run(_serve(index, queue, replies))